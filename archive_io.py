@@ -0,0 +1,356 @@
+import bisect
+import bz2
+import gzip
+import io
+import lzma
+import os
+import shutil
+import tempfile
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd поддерживается только при установленном пакете zstandard
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+BZ2_MAGIC = b"BZh"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+CHECKPOINT_SPAN = 4 << 20  # Расстояние между контрольными точками gzip (в несжатых байтах)
+BLOCK_SIZE = 1 << 16
+
+
+def detect_compression(path):
+    """
+    Определяет сжатие архива по сигнатуре: "gzip", "xz", "bz2", "zstd" или None.
+    """
+    with open(path, "rb") as archive:
+        magic = archive.read(6)
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    if magic.startswith(XZ_MAGIC):
+        return "xz"
+    if magic.startswith(BZ2_MAGIC):
+        return "bz2"
+    if magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def copy_range(src_fd, dst_fd, offset, length, block_size=1 << 20):
+    """
+    Копирует length байт из src_fd (начиная с offset) в текущую позицию dst_fd.
+    Используется copy_file_range/sendfile, если ОС их поддерживает, иначе блочное копирование.
+    """
+    while length > 0:
+        try:
+            if hasattr(os, "copy_file_range"):
+                copied = os.copy_file_range(src_fd, dst_fd, length, offset)
+            elif hasattr(os, "sendfile"):
+                copied = os.sendfile(dst_fd, src_fd, offset, length)
+            else:
+                raise OSError
+        except OSError:
+            copied = os.write(dst_fd, os.pread(src_fd, min(length, block_size), offset)
+                              if hasattr(os, "pread") else _read_block(src_fd, offset, min(length, block_size)))
+        if copied <= 0:
+            raise IOError("Unexpected end of archive while copying.")
+        offset += copied
+        length -= copied
+
+
+def _read_block(fd, offset, size):
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, size)
+
+
+class PlainArchive:
+    """
+    Несжатый tar: позиционное чтение и копирование диапазонов без участия Python-буферов.
+    """
+    compression = None
+
+    def __init__(self, path):
+        self.path = path
+        self.plain_path = path  # Несжатый tar на диске: его можно читать по смещениям из других процессов
+        self._file = open(path, "rb")
+        self._lock = threading.Lock()
+
+    def pread(self, offset, size):
+        if hasattr(os, "pread"):
+            return os.pread(self._file.fileno(), size, offset)
+        with self._lock:  # seek + read не атомарны без pread (Windows)
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def open_stream(self):
+        return open(self.path, "rb")
+
+    def create_writer(self, path):
+        return open(path, "wb", buffering=0)
+
+    def copy_to(self, writer, offset, length):
+        if not isinstance(writer, io.FileIO):  # Сжимающий writer: байты должны пройти через него
+            _copy_by_blocks(self, writer, offset, length)
+            return
+        copy_range(self._file.fileno(), writer.fileno(), offset, length)
+
+    def close(self):
+        self._file.close()
+
+
+class GzipCheckpoints:
+    """
+    Контрольные точки gzip в стиле zran: через каждые span несжатых байт
+    запоминаются сжатое смещение и копия состояния распаковщика zlib.
+    Список только растёт и общий для всех читателей одного архива.
+    """
+    def __init__(self, span=CHECKPOINT_SPAN):
+        self.span = span
+        self.offsets = [0]
+        self.points = [(0, None)]  # (сжатое смещение, состояние zlib); None — начало потока
+        self._lock = threading.Lock()
+
+    def add(self, uncompressed, compressed, decompressor):
+        with self._lock:
+            if uncompressed >= self.offsets[-1] + self.span:
+                self.offsets.append(uncompressed)
+                self.points.append((compressed, decompressor.copy()))
+
+    def nearest(self, offset):
+        """
+        Возвращает ближайшую контрольную точку не дальше offset.
+        """
+        with self._lock:
+            index = bisect.bisect_right(self.offsets, offset) - 1
+            return self.offsets[index], self.points[index]
+
+
+class GzipIndexedReader(io.RawIOBase):
+    """
+    Файловый объект с произвольным доступом к распакованному gzip-потоку.
+    Чтение с любой позиции начинается с ближайшей контрольной точки, а при
+    последовательном проходе новые точки добавляются по пути.
+    """
+    def __init__(self, path, checkpoints):
+        super().__init__()
+        self._raw = open(path, "rb")
+        self._checkpoints = checkpoints
+        self._pos = 0
+        self._decompressor = None
+        self._out_pos = 0  # Несжатое смещение следующего байта, который выдаст распаковщик
+        self._raw_pos = 0  # Сжатое смещение следующего непрочитанного байта
+        self._tail = b""  # Сжатые байты, которые распаковщик ещё не потребил
+        self._eof = False
+        self._member_start = True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            raise io.UnsupportedOperation("Seeking from the end of a gzip stream is not supported.")
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def _restore(self, offset):
+        """
+        Переходит к ближайшей контрольной точке, если текущее состояние не подходит.
+        """
+        point_offset, (compressed, decompressor) = self._checkpoints.nearest(offset)
+        if self._decompressor is not None and point_offset <= self._out_pos <= offset:
+            return  # Продолжить с текущего места дешевле
+        self._decompressor = decompressor.copy() if decompressor else zlib.decompressobj(31)
+        self._out_pos = point_offset
+        self._raw_pos = compressed
+        self._tail = b""
+        self._eof = False
+        self._member_start = decompressor is None
+
+    def _produce(self, limit):
+        """
+        Распаковывает не больше limit байт; пустой результат при eof означает конец потока.
+        """
+        while not self._eof:
+            data = self._tail
+            if not data:
+                self._raw.seek(self._raw_pos)
+                data = self._raw.read(BLOCK_SIZE)
+                self._raw_pos += len(data)
+                if not data:
+                    self._eof = True
+                    break
+            try:
+                out = self._decompressor.decompress(data, limit)
+            except zlib.error:
+                if self._member_start:
+                    self._eof = True  # После последнего члена gzip лежит не gzip (например, нули)
+                    break
+                raise
+            self._member_start = False
+            self._tail = self._decompressor.unconsumed_tail
+            if self._decompressor.eof:
+                # Следующий член gzip (несколько потоков подряд) или конец файла
+                rest = self._decompressor.unused_data + self._tail
+                self._decompressor = zlib.decompressobj(31)
+                self._member_start = True
+                self._tail = rest
+            self._out_pos += len(out)
+            if not self._member_start:
+                self._checkpoints.add(self._out_pos, self._raw_pos - len(self._tail),
+                                      self._decompressor)
+            if out:
+                return out
+        return b""
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(BLOCK_SIZE)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+        self._restore(self._pos)
+        while self._out_pos < self._pos:  # Пропускаем данные до нужной позиции
+            if not self._produce(min(self._pos - self._out_pos, BLOCK_SIZE)):
+                return b""
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self._produce(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        data = b"".join(chunks)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+class GzipArchive:
+    """
+    tar.gz с индексом контрольных точек: cat распаковывает только от ближайшей точки.
+    """
+    compression = "gzip"
+    plain_path = None
+
+    def __init__(self, path):
+        self.path = path
+        self.checkpoints = GzipCheckpoints()
+        self._reader = GzipIndexedReader(path, self.checkpoints)
+        self._lock = threading.Lock()
+
+    def pread(self, offset, size):
+        with self._lock:
+            self._reader.seek(offset)
+            return self._reader.read(size)
+
+    def open_stream(self):
+        return GzipIndexedReader(self.path, self.checkpoints)
+
+    def create_writer(self, path):
+        return gzip.open(path, "wb", compresslevel=6)
+
+    def copy_to(self, writer, offset, length):
+        _copy_by_blocks(self, writer, offset, length)
+
+    def close(self):
+        self._reader.close()
+
+
+class SpooledArchive(PlainArchive):
+    """
+    xz, bz2 и zstd не позволяют сохранить состояние распаковщика, поэтому архив
+    один раз распаковывается во временный файл, и дальше чтение идёт из него.
+    """
+    def __init__(self, path, compression):
+        self.compression = compression
+        self.source_path = path
+        descriptor, spool_path = tempfile.mkstemp(suffix=".tar")
+        try:
+            with open(descriptor, "wb") as spool, _open_decompressed(path, compression) as source:
+                shutil.copyfileobj(source, spool, 1 << 20)
+        except BaseException:
+            os.remove(spool_path)
+            raise
+        super().__init__(spool_path)
+
+    def create_writer(self, path):
+        return _open_compressed_writer(path, self.compression)
+
+    def copy_to(self, writer, offset, length):
+        _copy_by_blocks(self, writer, offset, length)
+
+    def close(self):
+        super().close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _copy_by_blocks(archive, writer, offset, length, block_size=1 << 20):
+    while length > 0:
+        data = archive.pread(offset, min(length, block_size))
+        if not data:
+            raise IOError("Unexpected end of archive while copying.")
+        writer.write(data)
+        offset += len(data)
+        length -= len(data)
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("Reading .tar.zst archives requires the 'zstandard' package.")
+
+
+def _open_decompressed(path, compression):
+    if compression == "xz":
+        return lzma.open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    _require_zstandard()
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+
+
+def _open_compressed_writer(path, compression):
+    if compression == "xz":
+        return lzma.open(path, "wb")
+    if compression == "bz2":
+        return bz2.open(path, "wb")
+    _require_zstandard()
+    return zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True)
+
+
+def open_archive(path):
+    """
+    Открывает архив с подходящей стратегией произвольного доступа.
+    Все смещения — в несжатом tar-потоке.
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return PlainArchive(path)
+    if compression == "gzip":
+        return GzipArchive(path)
+    return SpooledArchive(path, compression)
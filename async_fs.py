@@ -0,0 +1,146 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from fs_handler import VirtualFileSystem
+
+
+class AsyncVirtualFileSystem:
+    """
+    asyncio-фасад над VirtualFileSystem для встраивания в сервисы.
+    Загрузка индекса и чтение архива выполняются в пуле потоков, поэтому цикл событий
+    не блокируется. Каждая операция идёт под общей блокировкой дерева (как в server.py):
+    чтения выполняются параллельно, удаление и commit — монопольно.
+    Ошибки те же, что у синхронного API (подклассы OSError).
+    """
+    def __init__(self, fs, max_workers=None):
+        self.fs = fs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    @classmethod
+    async def load(cls, tar_path, max_workers=None, **options):
+        """
+        Открывает архив (или слои) в пуле потоков; options передаются VirtualFileSystem.
+        """
+        facade = cls(None, max_workers)
+        try:
+            facade.fs = await facade._call(VirtualFileSystem, tar_path, **options)
+        except BaseException:
+            facade._executor.shutdown(wait=False)
+            raise
+        return facade
+
+    def _call(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    def _locked(self, lock, function, *args, **kwargs):
+        def run():
+            with lock():
+                return function(*args, **kwargs)
+        return self._call(run)
+
+    def _read(self, function, *args, **kwargs):
+        return self._locked(self.fs.lock.read, function, *args, **kwargs)
+
+    def _write(self, function, *args, **kwargs):
+        return self._locked(self.fs.lock.write, function, *args, **kwargs)
+
+    async def stat(self, path):
+        return await self._read(self.fs.stat, path)
+
+    async def listdir(self, path="/"):
+        return await self._read(self.fs.listdir, path)
+
+    async def walk(self, top="/"):
+        """
+        Асинхронный аналог VirtualFileSystem.walk: обход по индексу целиком выполняется
+        в пуле потоков, затем кортежи отдаются по одному.
+        """
+        for entry in await self._read(lambda: list(self.fs.walk(top))):
+            yield entry
+
+    async def open(self, path, mode="rb", encoding="utf-8", errors="strict"):
+        """
+        Открывает файл на чтение; возвращает AsyncArchiveFile.
+        """
+        stream = await self._read(self.fs.open, path, mode, encoding, errors)
+        return AsyncArchiveFile(self, stream)
+
+    async def read_bytes(self, path):
+        """
+        Всё содержимое файла одним вызовом (с проверкой прав, как у open).
+        """
+        def read():
+            with self.fs.open(path) as stream:
+                return stream.read()
+        return await self._read(read)
+
+    async def remove(self, path, recursive=False):
+        await self._write(self.fs.remove, path, recursive)
+
+    async def set_permissions(self, path, mode, recursive=False):
+        await self._write(self.fs.set_permissions, path, mode, recursive)
+
+    async def refresh(self):
+        """
+        Подхватывает изменения архива на диске (см. VirtualFileSystem.refresh).
+        """
+        return await self._write(self.fs.refresh)
+
+    async def commit(self, output=None):
+        return await self._write(self.fs.commit, output)
+
+    async def close(self):
+        """
+        Дожидается начатых операций и закрывает архивы.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        if self.fs is not None:
+            self.fs.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class AsyncArchiveFile:
+    """
+    Открытый файл архива для корутин: чтение выполняется в пуле потоков фасада.
+    """
+    def __init__(self, facade, stream):
+        self._facade = facade
+        self._stream = stream
+        self.name = getattr(stream, "name", None)
+
+    async def read(self, size=-1):
+        return await self._facade._read(self._stream.read, size)
+
+    async def readline(self, size=-1):
+        return await self._facade._read(self._stream.readline, size)
+
+    async def seek(self, offset, whence=0):
+        return await self._facade._read(self._stream.seek, offset, whence)
+
+    def tell(self):
+        return self._stream.tell()
+
+    async def close(self):
+        self._stream.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.readline()
+        if not line:
+            raise StopAsyncIteration
+        return line
@@ -0,0 +1,285 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tarfile
+import tempfile
+import time
+
+from emulator import ShellEmulator
+from fs_handler import VirtualFileSystem
+
+RESULT_VERSION = 1
+LARGE_NAME = "large.bin"
+
+
+class PatternReader:
+    """
+    Файловый объект, отдающий size байт текстовых строк без хранения всего содержимого в памяти.
+    """
+    BLOCK = b"".join(b"benchmark line %06d lorem ipsum dolor sit amet\n" % i for i in range(20000))
+
+    def __init__(self, size, shift=0):
+        self.remaining = size
+        self.position = shift % len(self.BLOCK)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        parts = []
+        while size > 0:
+            piece = self.BLOCK[self.position:self.position + size]
+            parts.append(piece)
+            size -= len(piece)
+            self.remaining -= len(piece)
+            self.position = (self.position + len(piece)) % len(self.BLOCK)
+        return b"".join(parts)
+
+
+def directory_path(level, index=0):
+    """
+    Путь директории на глубине level вдоль ветки из index-ных поддиректорий: d0/d0/...
+    """
+    return "/".join([f"d{index}"] * level)
+
+
+def file_size(rng, distribution, mean, max_size):
+    if distribution == "fixed":
+        size = mean
+    elif distribution == "uniform":
+        size = rng.randint(0, 2 * mean)
+    else:
+        # Логнормальное распределение со средним mean: много мелких файлов и редкие крупные
+        sigma = 1.0
+        size = int(rng.lognormvariate(math.log(max(mean, 1)) - sigma * sigma / 2, sigma))
+    return min(size, max_size)
+
+
+def generate_archive(path, members, depth, fanout, distribution="lognormal",
+                     mean_size=4096, max_size=1 << 20, large_size=8 << 20, seed=0):
+    """
+    Создаёт синтетический tar: дерево директорий глубины depth с fanout поддиректориями
+    на каждом уровне, members файлов, распределённых по листовым директориям, и один
+    большой файл в корне. Возвращает описание сгенерированного архива.
+    """
+    rng = random.Random(seed)
+    levels = [[""]]
+    for _ in range(depth):
+        levels.append([f"{parent}/d{i}".lstrip("/") for parent in levels[-1] for i in range(fanout)])
+    leaves = levels[-1]
+    small = []
+    total = 0
+    with tarfile.open(path, "w", format=tarfile.GNU_FORMAT) as tar:
+        for level in levels[1:]:
+            for directory in level:
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+        for number in range(members):
+            directory = leaves[number % len(leaves)]
+            info = tarfile.TarInfo(f"{directory}/f{number}.txt".lstrip("/"))
+            info.size = file_size(rng, distribution, mean_size, max_size)
+            info.mode = 0o644
+            tar.addfile(info, PatternReader(info.size, number * 97))
+            total += info.size
+            if 0 < info.size <= mean_size and len(small) < 16:
+                small.append(info.name)
+        info = tarfile.TarInfo(LARGE_NAME)
+        info.size = large_size
+        info.mode = 0o644
+        tar.addfile(info, PatternReader(large_size))
+    return {"members": members + sum(len(level) for level in levels[1:]) + 1,
+            "files": members, "directories": sum(len(level) for level in levels[1:]),
+            "data_bytes": total + large_size, "archive_bytes": os.path.getsize(path),
+            "small_files": small}
+
+
+def drain(result):
+    """
+    Дочитывает поток вывода команды, чтобы в замер попало всё чтение архива.
+    """
+    if result is not None and not isinstance(result, str):
+        for _ in result:
+            pass
+
+
+def measure(action, repeat, setup=None, teardown=None):
+    """
+    Выполняет action repeat раз; setup и teardown в замер не входят.
+    Возвращает список длительностей в секундах.
+    """
+    timings = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        started = time.perf_counter()
+        action(state)
+        timings.append(time.perf_counter() - started)
+        if teardown:
+            teardown(state)
+    return timings
+
+
+def run_benchmarks(archive, info, depth, repeat, workdir):
+    """
+    Прогоняет все замеры над архивом и возвращает список результатов.
+    """
+    results = []
+
+    def record(name, timings):
+        results.append({"name": name, "runs": len(timings), "min": min(timings),
+                        "median": statistics.median(timings), "mean": statistics.fmean(timings)})
+        print(f"  {name}", file=sys.stderr)
+
+    index_path = archive + ".idx"
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    record("startup (full parse)", measure(
+        lambda _: VirtualFileSystem(archive, use_index_cache=False).close(), repeat))
+    VirtualFileSystem(archive).close()  # Создаёт <архив>.idx для тёплого старта
+    record("startup (index cache)", measure(lambda _: VirtualFileSystem(archive).close(), repeat))
+
+    fs = VirtualFileSystem(archive)
+    uncached = VirtualFileSystem(archive, cache_size=0)
+    shell = ShellEmulator(archive, fs=fs)
+    cold_shell = ShellEmulator(archive, fs=uncached)
+
+    for level in range(depth + 1):
+        target = "/" + directory_path(level)
+        if fs.lookup(target) is None:
+            break  # Готовый архив (--archive) может не содержать ветки d0/d0/...
+
+        def cd(_, target=target):
+            shell.current_dir = "/"
+            shell.execute_command(f"cd {target}")
+
+        def ls(_, target=target):
+            shell.current_dir = target
+            drain(shell.execute_command("ls"))
+
+        record(f"cd depth {level}", measure(cd, repeat))
+        record(f"ls depth {level}", measure(ls, repeat))
+    shell.current_dir = "/"
+
+    small = info.get("small_files") or []
+    if small:
+        record("cat small", measure(
+            lambda _: [drain(cold_shell.execute_command(f"cat /{name}")) for name in small], repeat))
+        for name in small:  # Прогрев кэша
+            drain(shell.execute_command(f"cat /{name}"))
+        record("cat small (cached)", measure(
+            lambda _: [drain(shell.execute_command(f"cat /{name}")) for name in small], repeat))
+    if fs.lookup(LARGE_NAME) is not None:
+        record("cat large", measure(lambda _: drain(shell.execute_command(f"cat /{LARGE_NAME}")), repeat))
+    has_subtree = depth > 0 and fs.lookup(directory_path(1)) is not None
+    fs.close()
+    uncached.close()
+
+    if has_subtree:
+        # rm меняет только оверлей в памяти, поэтому каждый прогон на свежем индексе
+        def fresh_shell():
+            return ShellEmulator(archive)
+
+        record("rm -r subtree", measure(
+            lambda state: state.execute_command(f"rm -r /{directory_path(1)}"), repeat,
+            setup=fresh_shell, teardown=lambda state: state.fs.close()))
+
+        copy = os.path.join(workdir, "commit.tar")
+
+        def prepared_commit():
+            shutil.copyfile(archive, copy)
+            state = ShellEmulator(copy, use_index_cache=False)
+            state.execute_command(f"rm -r /{directory_path(1)}")
+            return state
+
+        record("commit after rm -r", measure(
+            lambda state: state.execute_command("commit"), repeat,
+            setup=prepared_commit, teardown=lambda state: state.fs.close()))
+    return results
+
+
+def format_table(results, baseline=None):
+    """
+    Таблица результатов; при наличии baseline — изменение медианы относительно него.
+    """
+    previous = {result["name"]: result for result in (baseline or {}).get("results", [])}
+    header = f"{'benchmark':<24}{'runs':>6}{'min ms':>12}{'median ms':>12}{'mean ms':>12}"
+    if baseline is not None:
+        header += f"{'vs base':>10}"
+    lines = [header]
+    for result in results:
+        line = (f"{result['name']:<24}{result['runs']:>6}{result['min'] * 1000:>12.3f}"
+                f"{result['median'] * 1000:>12.3f}{result['mean'] * 1000:>12.3f}")
+        if baseline is not None:
+            base = previous.get(result["name"])
+            if base and base["median"] > 0:
+                line += f"{(result['median'] / base['median'] - 1) * 100:>+9.1f}%"
+            else:
+                line += f"{'-':>10}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the shell emulator on a synthetic archive")
+    parser.add_argument("--members", type=int, default=20000, help="Number of files in the archive")
+    parser.add_argument("--depth", type=int, default=3, help="Depth of the directory tree")
+    parser.add_argument("--fanout", type=int, default=8, help="Subdirectories per directory")
+    parser.add_argument("--size-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal",
+                        help="File size distribution")
+    parser.add_argument("--mean-size", type=int, default=4096, help="Mean file size in bytes")
+    parser.add_argument("--max-size", type=int, default=1 << 20, help="Upper bound of a file size in bytes")
+    parser.add_argument("--large-size", type=int, default=8 << 20,
+                        help="Size of the large member used by the 'cat large' benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark")
+    parser.add_argument("--archive", help="Benchmark an existing archive (a copy is used) instead of generating one")
+    parser.add_argument("--json", default="bench_results.json", metavar="PATH",
+                        help="Where to write the JSON results")
+    parser.add_argument("--compare", metavar="PATH", help="Previous JSON results to compare against")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="emulator-bench-")
+    try:
+        archive = os.path.join(workdir, "bench.tar")
+        depth = args.depth
+        if args.archive:
+            shutil.copyfile(args.archive, archive)
+            info = {"source": os.path.abspath(args.archive), "archive_bytes": os.path.getsize(archive)}
+        else:
+            print("Generating archive...", file=sys.stderr)
+            started = time.perf_counter()
+            info = generate_archive(archive, args.members, args.depth, args.fanout, args.size_dist,
+                                    args.mean_size, args.max_size, args.large_size, args.seed)
+            info["generate_seconds"] = time.perf_counter() - started
+        print("Running benchmarks...", file=sys.stderr)
+        results = run_benchmarks(archive, info, depth, args.repeat, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as previous:
+            baseline = json.load(previous)
+    print(format_table(results, baseline))
+
+    params = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+    report = {"version": RESULT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "params": params, "archive": {key: value for key, value in info.items() if key != "small_files"},
+              "results": results}
+    with open(args.json, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,327 +1,1041 @@
 import argparse
+import codecs
+import cProfile
+import io
 import os
+import pstats
+import re
+import shlex
 import sys
 import tarfile
+import time
+from collections import namedtuple
 
-from fs_handler import VirtualFileSystem
+try:
+    import readline
+except ImportError:  # Нет на Windows без pyreadline: приглашение работает без дополнения и истории
+    readline = None
+
+from fs_handler import (DEFAULT_CACHE_SIZE, REFRESH_APPENDED, REFRESH_RELOADED, VirtualFileSystem, format_mode,
+                        has_glob, parse_mode, split_path)
+from instrumentation import EXPORT_FORMATS, Tracer
+
+PROFILE_LINES = 25  # Сколько самых затратных функций показывает profile
+COMMANDS = ("cat", "cd", "chmod", "commit", "compact", "cp", "du", "echo", "exit", "find", "grep", "head",
+            "ls", "mkdir", "mv", "profile", "refresh", "rm", "stat", "stats", "sync", "tail", "touch", "trace")
+MAX_COMPLETIONS = 1000  # Больше вариантов в огромной директории всё равно никто не пролистает
+HISTORY_FILE = os.path.join(os.path.expanduser("~"), ".emulator_history")
+HISTORY_LENGTH = 1000
+
+# Результат одной команды пакетного режима
+BatchResult = namedtuple("BatchResult", ["command", "output", "seconds"])
 
 
 class ShellEmulator:
-    def __init__(self, fs_path):
-        self.fs = VirtualFileSystem(fs_path)
+    def __init__(self, fs_path, lazy=False, use_index_cache=True, uid=None, gid=None, fs=None,
+                 cache_size=DEFAULT_CACHE_SIZE, tracer=None, index_workers=None, watch=None):
+        # Можно передать уже загруженную файловую систему, чтобы сессии делили один индекс
+        self.fs = fs if fs is not None else VirtualFileSystem(
+            fs_path, lazy=lazy, use_index_cache=use_index_cache, uid=uid, gid=gid,
+            cache_size=cache_size, tracer=tracer, index_workers=index_workers)
         self.current_dir = '/'  # Начальная директория
+        self.running = True
+        self._completions = []  # Варианты текущего дополнения readline
+        # Опрос архива на диске перед командами не чаще раза в watch секунд (None — не следить)
+        self.watch = watch
+        self._next_poll = 0.0
 
     def prompt(self):
         return f"emulator:{self.current_dir}$ "
 
+    def resolve_path(self, path):
+        """
+        Строит нормализованный абсолютный путь с учётом текущей директории, '.' и '..'.
+        """
+        if not path.startswith('/'):
+            path = self.current_dir.rstrip('/') + '/' + path
+        parts = []
+        for part in split_path(path):
+            if part == '..':
+                if parts:
+                    parts.pop()
+            else:
+                parts.append(part)
+        return '/' + '/'.join(parts)
+
     def execute_command(self, command):
-        if command == "ls":
-            return self.ls()
+        """
+        Выполняет команду и учитывает её время в fs.tracer. Для потокового вывода замер
+        закрывается, когда поток дочитан, чтобы чтение архива попало в ту же команду.
+        """
+        name = command.split(" ", 1)[0]
+        if self.watch is not None and time.monotonic() >= self._next_poll:
+            self._next_poll = time.monotonic() + self.watch
+            try:
+                self._refreshed(self.fs.refresh())
+            except (OSError, tarfile.TarError) as error:
+                # Прежний индекс остаётся рабочим, следующая проверка попробует снова
+                print(f"Archive refresh failed: {error}", file=sys.stderr)
+        tracer = self.fs.tracer
+        token = tracer.begin_command()
+        try:
+            result = self.dispatch(command)
+        except BaseException:
+            tracer.end_command(name, token, command)
+            raise
+        if result is None or isinstance(result, str):
+            tracer.end_command(name, token, command)
+            return result
+        return self._timed_stream(result, name, token, command)
+
+    def _timed_stream(self, chunks, name, token, command):
+        try:
+            yield from chunks
+        finally:
+            self.fs.tracer.end_command(name, token, command)
+
+    def dispatch(self, command):
+        if command == "ls" or command.startswith("ls "):
+            flags, paths = split_flags(command.split()[1:])
+            # -a допускается для совместимости: ls и так показывает все имена, включая скрытые
+            if len(paths) > 1 or not flags <= {"l", "a"}:
+                return "Usage: ls [-la] [<path>]"
+            return self.ls(paths[0] if paths else None, "l" in flags)
+        elif command.startswith("stat "):
+            return self.for_each_match(command.split(" ", 1)[1], self.stat)
+        elif command == "du" or command.startswith("du "):
+            return self.du(command.split()[1:])
         elif command.startswith("cd "):
             directory = command.split(" ", 1)[1]
             return self.cd(directory)
         elif command.startswith("chmod "):
-            args = command.split(" ", 2)
-            if len(args) != 3:
-                return "Usage: chmod <permissions> <filename>"
-            return self.chmod(args[1], args[2])
+            recursive, args = take_flag(command.split(" ", 1)[1], ("-R",))
+            args = args.split(" ", 1)
+            if len(args) != 2:
+                return "Usage: chmod [-R] <permissions> <filename>"
+            return self.for_each_match(args[1], lambda path: self.chmod(path, args[0], recursive))
         elif command.startswith("rm "):
-            filename = command.split(" ", 1)[1]
-            return self.rm(filename)
+            recursive, filename = take_flag(command.split(" ", 1)[1], ("-r", "-R"))
+            return self.for_each_match(filename, lambda path: self.rm(path, recursive))
+        elif command.startswith("cat --range "):
+            args = command.split(" ", 3)
+            try:
+                start, end = parse_byte_range(args[2])
+            except (IndexError, ValueError):
+                return "Usage: cat --range <start>:<end> <filename>"
+            if len(args) != 4:
+                return "Usage: cat --range <start>:<end> <filename>"
+            return self.for_each_match(args[3], lambda path: self.cat(path, start, end))
         elif command.startswith("cat "):
             filename = command.split(" ", 1)[1]
-            return self.cat(filename)
+            return self.for_each_match(filename, self.cat)
+        elif command.startswith("head ") or command.startswith("tail "):
+            name, args = command.split(" ", 1)
+            lines = 10
+            if args.startswith("-n "):
+                parts = args.split(" ", 2)
+                if len(parts) != 3 or not parts[1].isdigit():
+                    return f"Usage: {name} [-n <lines>] <filename>"
+                lines, args = int(parts[1]), parts[2]
+            handler = self.head if name == "head" else self.tail
+            return self.for_each_match(args, lambda path: handler(path, lines))
+        elif command == "find" or command.startswith("find "):
+            return self.find(command)
+        elif command.startswith("grep "):
+            return self.grep(command)
+        elif command.startswith("touch "):
+            return self.for_each_match(command.split(" ", 1)[1], self.touch)
+        elif command.startswith("mkdir "):
+            return self.mkdir(command.split()[1:])
+        elif command.split(" ", 1)[0] in ("cp", "mv"):
+            return self.copy_or_move(command)
+        elif command == "echo" or command.startswith("echo "):
+            return self.echo(command[5:])
+        elif command.split(" ", 1)[0] in ("commit", "sync"):
+            args = command.split()
+            if len(args) > 2:
+                return "Usage: commit [<output archive>]"
+            return self.commit(args[1] if len(args) == 2 else None)
+        elif command.split(" ", 1)[0] == "compact":
+            args = command.split()
+            if len(args) > 2:
+                return "Usage: compact [<output archive>]"
+            return self.compact(args[1] if len(args) == 2 else None)
+        elif command == "stats":
+            return self.stats()
+        elif command == "refresh":
+            return self.refresh()
+        elif command.startswith("profile "):
+            return self.profile(command.split(" ", 1)[1])
+        elif command == "trace" or command.startswith("trace "):
+            return self.trace(command.split()[1:])
         elif command == "exit":
-            sys.exit(0)
+            self.running = False
+            return None
         else:
             return f"Unknown command: {command}"
 
-    def ls(self):
-        """
-        Выводит содержимое текущей директории.
-        """
-        files = self.fs.list_files()
-
-        # Определяем путь текущей директории
-        # current_path = self.current_dir.lstrip('/') + '/' if self.current_dir != '/' else ''
-        current_path = self.current_dir.lstrip('/') if self.current_dir != '/' else ''
-        #print(current_path)
-        #print(self.current_dir)
-        #print(files)
-        #print('end')
-
-        if current_path != '':
-            if current_path[-1] != '/':
-                current_path += '/'
-
-        # Фильтруем файлы текущей директории
-        filtered_files = set()  # Используем множество для исключения дублирования
-        for file in files:
-            if file.startswith(current_path):
-                relative_path = file[len(current_path):]
-                top_level_item = relative_path.split('/')[0]  # Берём только верхний уровень
-                filtered_files.add(top_level_item)
-
-        # Возвращаем отсортированный список файлов/директорий
-        return '\n'.join(sorted(filtered_files))
-
-    # def ls(self):
-    #     files = self.fs.list_files()
-    #     # Фильтруем файлы текущей директории
-    #     current_path = self.current_dir.lstrip('/') + '/' if self.current_dir != '/' else ''
-    #     filtered_files = [f[len(current_path):].split('/')[0] for f in files if f.startswith(current_path)]
-    #     # print(filtered_files)
-    #     return '\n'.join(sorted(set(filtered_files)))
-
-    # def ls(self):
-    #     """
-    #     Список файлов и директорий в текущей директории.
-    #     """
-    #     files = [name for name in self.fs.metadata if name.startswith(self.current_dir)]
-    #     relative_files = [os.path.relpath(file, self.current_dir) for file in files]
-    #     print("\n".join(relative_files))
-
-    # def cd(self, directory):
-    #     if directory == '/':
-    #         self.current_dir = '/'
-    #     elif directory == '..':
-    #         self.current_dir = '/'.join(self.current_dir.rstrip('/').split('/')[:-1]) or '/'
-    #     else:
-    #         new_path = self.current_dir.rstrip('/') + '/' + directory if self.current_dir != '/' else '/' + directory
-    #         print(directory)
-    #         print(new_path)
-    #         if any(f.startswith(new_path + '/') or f == new_path for f in self.fs.list_files()):
-    #             self.current_dir = new_path
-    #         else:
-    #             return f"Directory not found: {directory}"
-    #     return ""
+    def expand(self, pattern):
+        """
+        Раскрывает шаблон (*, ?, [...]) по индексу в список абсолютных путей.
+        Аргумент без шаблона или без совпадений возвращается как есть, как в bash.
+        """
+        if not has_glob(pattern):
+            return [pattern]
+        matches = self.fs.glob(self.resolve_path(pattern))
+        return ['/' + path for path in matches] or [pattern]
+
+    def for_each_match(self, pattern, handler):
+        """
+        Выполняет команду для каждого пути, подходящего под шаблон, и объединяет вывод.
+        """
+        paths = self.expand(pattern)
+        if len(paths) == 1:
+            return handler(paths[0])
+        return join_results(handler(path) for path in paths)
+
+    def find(self, command):
+        """
+        find [<директория>] [-name <шаблон>]: поиск по индексу без чтения архива.
+        Аргументы разбираются как в shell (shlex), так что шаблон можно взять в кавычки.
+        """
+        try:
+            args = shlex.split(command)[1:]
+        except ValueError as error:
+            return f"find: {error}"
+        pattern = None
+        if "-name" in args:
+            index = args.index("-name")
+            if index + 1 >= len(args):
+                return "Usage: find [<directory>] [-name <pattern>]"
+            pattern = args[index + 1]
+            args = args[:index] + args[index + 2:]
+        if len(args) > 1:
+            return "Usage: find [<directory>] [-name <pattern>]"
+        start = self.resolve_path(args[0] if args else ".")
+        if self.fs.lookup(start) is None:
+            return f"File or directory not found: {start}"
+        if not self.fs.check_path_access(start, "read"):
+            return f"Permission denied: {start}"
+        return ('/' + node.path() + '\n' for node in self.fs.find(start, pattern))
+
+    def grep(self, command):
+        """
+        grep [-r] <шаблон> <путь>: поиск регулярного выражения в содержимом файлов.
+        """
+        try:
+            args = shlex.split(command)[1:]
+        except ValueError as error:
+            return f"grep: {error}"
+        recursive = "-r" in args
+        args = [arg for arg in args if arg != "-r"]
+        if len(args) != 2:
+            return "Usage: grep [-r] <pattern> <path>"
+        pattern, target = args
+        try:
+            re.compile(pattern)
+        except re.error as error:
+            return f"grep: invalid pattern: {error}"
+        lines = []
+        for path in self.expand(target):
+            full_path = self.resolve_path(path)
+            node = self.fs.lookup(full_path)
+            if node is None:
+                lines.append(f"File or directory not found: {path}\n")
+            elif node.is_dir and not recursive:
+                lines.append(f"grep: {path}: Is a directory\n")
+            elif not self.fs.check_path_access(full_path, "read"):
+                lines.append(f"Permission denied: {path}\n")
+            else:
+                lines.append(self.fs.grep(pattern, full_path))
+        return join_results(
+            item if isinstance(item, str) else
+            (f"/{file_path}:{number}:{line}\n" for file_path, number, line in item)
+            for item in lines)
+
+    def ls(self, path=None, long_format=False):
+        """
+        Выводит содержимое директории (по умолчанию текущей); с long_format — права, владельца,
+        размер и время изменения каждого элемента.
+        """
+        full_path = self.current_dir if path is None else self.resolve_path(path)
+        node = self.fs.lookup(full_path)
+        if node is None:
+            return f"File or directory not found: {path}"
+        if not node.is_dir:
+            if not self.fs.is_searchable(node.parent):
+                return f"Permission denied: {path}"
+            return format_long(node, self._display_size(node)) if long_format else node.name
+        if not self.fs.check_path_access(full_path, "read"):
+            return f"Permission denied: {full_path}"
+        # Дети берутся прямо из узла директории, без обхода всего архива
+        names = self.fs.list_dir(full_path)
+        if not long_format:
+            return '\n'.join(names)
+        children = node.children
+        return '\n'.join(format_long(child, self._display_size(child))
+                         for child in (children[name] for name in names))
+
+    def _display_size(self, node):
+        """
+        Размер для ls -l и stat: у жёсткой ссылки — размер файла, на который она указывает,
+        у символической — длина цели (как у lstat).
+        """
+        if node.is_symlink:
+            return len(node.link_target.encode("utf-8", "surrogateescape"))
+        if not node.is_hardlink:
+            return node.size
+        try:
+            return self.fs.lookup(self.fs.resolve_link('/' + node.path())).size
+        except FileNotFoundError:
+            return 0
+
+    def stat(self, filename):
+        """
+        Выводит метаданные файла или директории; для директории — и суммы по поддереву.
+        """
+        full_path = self.resolve_path(filename)
+        node = self.fs.lookup(full_path)
+        if node is None:
+            return f"File or directory not found: {filename}"
+        if node.parent is not None and not self.fs.is_searchable(node.parent):
+            return f"Permission denied: {filename}"
+        if node.is_dir:
+            kind = "directory"
+        elif node.is_symlink:
+            kind = "symbolic link"
+        elif node.offset is not None or node.is_hardlink:
+            kind = "regular file"  # Жёсткая ссылка — то же содержимое под другим именем
+        else:
+            kind = "special file"
+        name = f"{full_path} -> {node.link_target}" if node.is_symlink else full_path
+        lines = [f"  File: {name}",
+                 f"  Type: {kind}  Size: {self._display_size(node)}",
+                 f"Access: ({node.mode:04o}/{file_type(node)}{format_mode(node.mode)})  "
+                 f"Uid: ({node.uid}/{node.owner})  Gid: ({node.gid}/{node.group})",
+                 f"Modify: {format_time(node.mtime)}"]
+        if node.is_dir:
+            lines.append(f" Total: {node.total_size} bytes in {node.file_count} file(s)")
+        return '\n'.join(lines)
+
+    def du(self, args):
+        """
+        du [-s] [-h] [<путь>...]: суммарный размер файлов в байтах (с -h — в K/M/G).
+        Суммы берутся из директорий готовыми, поэтому du -s стоит O(1) при любом размере поддерева;
+        без -s выводится каждая поддиректория.
+        """
+        flags, paths = split_flags(args)
+        if not flags <= {"s", "h"}:
+            return "Usage: du [-s] [-h] [<path>...]"
+        size_text = format_size if "h" in flags else str
+        lines = []
+        for pattern in paths or ["."]:
+            for path in self.expand(pattern):
+                full_path = self.resolve_path(path)
+                node = self.fs.lookup(full_path)
+                if node is None:
+                    lines.append(f"du: '{path}' not found.")
+                    continue
+                if not self.fs.check_path_access(full_path, "read"):
+                    lines.append(f"Permission denied: {path}")
+                    continue
+                nodes = [node]
+                if node.is_dir and "s" not in flags:
+                    # Поддиректории раньше родителя, как у du
+                    nodes = sorted((item for item in self.fs.find(full_path) if item.is_dir),
+                                   key=lambda item: split_path(item.path()) + ["\U0010ffff"])
+                for item in nodes:
+                    lines.append(f"{size_text(item.totals()[0])}\t/{item.path()}")
+        return '\n'.join(lines)
 
     def cd(self, directory):
         """
         Переход в другую директорию (эмуляция), с учетом прав доступа.
         """
-        if directory == '/':
-            # Переход в корневую директорию
-            self.current_dir = '/'
-            return ""
-
-        if directory == '..':
-            # Переход в родительскую директорию
-            if self.current_dir != '/':
-                self.current_dir = '/'.join(self.current_dir.rstrip('/').split('/')[:-1]) or '/'
-            return ""
-
-        # # Формируем полный путь (учитывая абсолютные и относительные пути)
-        # if directory.startswith('/'):  # Абсолютный путь
-        #     possible_path = directory.rstrip('/')
-        # else:  # Относительный путь
-        #     possible_path = self.current_dir.rstrip('/') + '/' + directory
-
-        if self.current_dir == '/' and len(self.current_dir) == 1:
-            # print(self.current_dir)
-            possible_path = self.current_dir.rstrip('/') + directory
-        elif directory[0] == '/' and len(directory) != 1:
-            possible_path = self.current_dir.rstrip('/')
-            # print(self.current_dir)
-            # print(directory[1:])
-            possible_path = directory[1:]
-        else:
-            # print(self.current_dir)
-            possible_path = self.current_dir.rstrip('/') + '/' + directory
+        possible_path = self.resolve_path(directory)
+        node = self.fs.lookup(possible_path)
 
         # Проверяем существование директории
-        #print(possible_path)
-        #print(self.fs.metadata)
-        if possible_path not in self.fs.metadata or not self.fs.metadata[possible_path]["is_dir"]:
+        if node is None or not node.is_dir:
             return f"Directory not found or not a directory: {directory}, path - {possible_path}"
 
-        # Проверяем права на выполнение для текущей директории
-        if not self.fs.file_has_permission(possible_path, "execute"):
+        # Проверяем права на выполнение для директории и всех директорий на пути к ней
+        if not self.fs.check_path_access(possible_path, "execute"):
             return f"No permission to access directory: {directory}, path - {possible_path}"
 
         # Если все проверки пройдены, обновляем текущую директорию
         self.current_dir = possible_path
         return ""
 
-    # def cd(self, directory):
-    #     # Переход в другую директорию (эмуляция).
-    #     if directory == '/':
-    #         self.current_dir = '/'
-    #     elif directory == '..':
-    #         # Переход в родительскую директорию
-    #         if self.current_dir != '/':
-    #             self.current_dir = '/'.join(self.current_dir.rstrip('/').split('/')[:-1]) or '/'
-    #     else:
-    #         # Определяем полный путь (абсолютный или относительный)
-    #         if self.current_dir == '/' and len(self.current_dir) == 1:
-    #             # print(self.current_dir)
-    #             possible_path = self.current_dir.rstrip('/') + directory
-    #         elif directory[0] == '/' and len(directory) != 1:
-    #             #  possible_path = self.current_dir.rstrip('/')
-    #             # print(self.current_dir)
-    #             # print(directory[1:])
-    #             possible_path = directory[1:]
-    #         else:
-    #             # print(self.current_dir)
-    #             possible_path = self.current_dir.rstrip('/') + '/' + directory
-    #
-    #         # Проверка, существует ли директория в виртуальной файловой системе
-    #         if any(f.startswith(possible_path + '/') or f == possible_path for f in self.fs.list_files()):
-    #             self.current_dir = possible_path
-    #         else:
-    #             return f"Directory not found: {directory}, path - {possible_path}"
-    #     return ""
-
-    def chmod(self, filename, new_permissions):
-        """
-        Изменяет права доступа к файлу.
-        """
-        if self.current_dir != '':
-            if self.current_dir[-1] != '/':
-                self.current_dir += '/'
-        full_path = self.current_dir + filename + '/'
-        #print(full_path)
-        #print(self.fs.metadata)
-        if full_path not in self.fs.metadata and full_path[-1] == '/':
-            full_path = full_path[:-1]
-            #print(full_path)
-        if full_path not in self.fs.metadata:
-            print(f"File '{filename}' not found.")
-            return
-
-        # Обновляем права
-        self.fs.metadata[full_path]["permissions"] = new_permissions
-        #print("new_permissions")
-        #print(new_permissions)
-        #print(self.fs.metadata[full_path]["permissions"])
-        #print("new_permissions")
-        print(f"Permissions for '{filename}' changed to '{new_permissions}'.")
-
-    # def chmod(self, permissions, filename):
-    #     full_path = self.current_dir.rstrip('/') + '/' + filename if self.current_dir != '/' else '/' + filename
-    #     return self.fs.chmod_file(full_path, permissions)
-
-    def rm(self, filename):
-        """
-        Удаляет файл или папку. Если это папка, удаляет её рекурсивно.
-        """
-        full_path = self.current_dir.rstrip('/') + '/' + filename if self.current_dir != '/' else '/' + filename
-        #print(f"Removing '{full_path}'")
-        #print(self.fs.metadata)
-        if full_path not in self.fs.metadata and full_path[-1] == '/':
-            full_path = full_path[:-1]
-        elif full_path not in self.fs.metadata and full_path[-1] != '/':
-            full_path += '/'
+    def chmod(self, filename, new_permissions, recursive=False):
+        """
+        Изменяет права доступа к файлу; с -R — у директории и всего её содержимого.
+        """
+        node = self.fs.lookup(self.resolve_path(filename))
+        if node is None or node == self.fs.root:
+            return f"File '{filename}' not found."
+        if not self.fs.is_searchable(node.parent):
+            return f"Permission denied: {filename}"
+
+        try:
+            mode = parse_mode(new_permissions)
+        except ValueError:
+            return f"Invalid mode: {new_permissions}"
+
+        # Чтобы пройти по поддереву, нужны чтение и проход во всех его директориях — уже
+        # с новыми правами, как у chmod -R, который меняет директорию до входа в неё;
+        # проверка делается целиком до изменений, чтобы не менять права наполовину
+        if recursive and node.is_dir:
+            blocked = self.fs.subtree_denied(node, ("read", "execute"), mode)
+            if blocked is not None:
+                return f"Permission denied: /{blocked.path()}"
+
+        # Обновляем права (только в оверлее, архив перезапишется при commit)
+        self.fs.set_permissions(node.path(), mode, recursive)
+        if recursive and node.is_dir:
+            return f"Permissions for '{filename}' and its contents changed to '{new_permissions}'."
+        return f"Permissions for '{filename}' changed to '{new_permissions}'."
+
+    def rm(self, filename, recursive=False):
+        """
+        Удаляет файл, а с -r — папку со всем содержимым.
+        """
+        full_path = self.resolve_path(filename)
+        node = self.fs.lookup(full_path)
 
         # Проверка существования
-        if full_path not in self.fs.metadata:
+        if node is None or node == self.fs.root:
             return f"File or directory not found: {full_path}"
 
-        # Проверка прав на запись
-        if not self.fs.file_has_permission(full_path, "write"):
+        # Проверка прав на запись в родительскую директорию
+        if not self.fs.can_remove(full_path):
             return f"Permission denied: {filename}"
+        if node.is_dir:
+            if not recursive:
+                return f"rm: cannot remove '{filename}': Is a directory (use -r)."
+            # Права всех непустых директорий поддерева проверяются одним проходом до удаления:
+            # либо поддерево удаляется целиком, либо не меняется ничего
+            blocked = self.fs.subtree_denied(node, ("read", "write", "execute"))
+            if blocked is not None:
+                return f"Permission denied: /{blocked.path()}"
 
-        # Если это директория
-        if self.fs.metadata[full_path]["is_dir"]:
-            if self.fs.file_has_permission(full_path, "write"):
-                # Рекурсивно удаляем содержимое директории
-                files_to_remove = [path for path in self.fs.metadata if path.startswith(full_path + '/')]
-                #print("files_to_remove")
-                #print(files_to_remove)
-                #print("files_to_remove")
-                for path in files_to_remove:
-                    self.fs.remove_file(path)  # Удаляем из архива
-                    del self.fs.metadata[path]  # Удаляем из метаданных
-
-                return f"Directory '{filename}' and its contents successfully removed."
-            else:
-                return f"Permission for directory denied: {filename}"
-
-        # Если это файл
+        # Поддерево отцепляется от дерева за один вызов, архив перезапишется при commit
         self.fs.remove_file(full_path)
-        del self.fs.metadata[full_path]
+        if node.is_dir:
+            return f"Directory '{filename}' and its contents successfully removed."
         return f"File '{filename}' successfully removed."
 
-    # def rm(self, filename):
-    #     """
-    #     Удаляет файл в текущей директории, если у пользователя есть права на запись.
-    #     """
-    #     # Формируем полный путь
-    #     full_path = self.current_dir.rstrip('/') + '/' + filename if self.current_dir != '/' else '/' + filename
-    #
-    #     # Проверяем, существует ли файл
-    #     if full_path not in self.fs.metadata:
-    #         print(f"File not found: {filename}")
-    #         return
-    #
-    #     # Проверяем права на запись
-    #     if not self.fs.file_has_permission(full_path, "write"):
-    #         print(f"Permission denied: {filename}")
-    #         return
-    #
-    #     # Удаляем файл
-    #     try:
-    #         self.fs.remove_file(full_path)
-    #         print(f"File '{filename}' successfully removed.")
-    #     except Exception as e:
-    #         print(f"Error while removing file '{filename}': {e}")
-
-    # def rm(self, filename):
-    #     full_path = self.current_dir + '/' + filename
-    #     if not self.fs.file_has_permission(full_path, "write"):
-    #         print(f"Permission denied: {filename}")
-    #         return
-    #     full_path = self.current_dir.rstrip('/') + '/' + filename if self.current_dir != '/' else '/' + filename
-    #     return self.fs.remove_file(full_path)
-
-    # def cat(self, filename):
-    #     if not self.fs.file_has_permission(filename, "read"):
-    #         print(f"Permission denied: {filename}")
-    #         return
-    #     full_path = self.current_dir.rstrip('/') + '/' + filename if self.current_dir != '/' else '/' + filename
-    #     return self.fs.open_file(full_path)
-    def cat(self, filename):
-        """
-        Выводит содержимое файла, если у пользователя есть права на чтение.
-        """
-        if self.current_dir != '':
-            if self.current_dir[-1] == '/':
-                self.current_dir = self.current_dir[:-1]
-        full_path = self.current_dir + '/' + filename
-
-        if not self.fs.file_has_permission(full_path, "read"):
-            print(f"No permission to read '{filename}'.")
-            return
-
-        with tarfile.open(self.fs.tar_path, "r") as tar:
+    def _check_writable(self, filename):
+        """
+        Проверяет, что в путь можно записать файл: родитель доступен на проход и запись,
+        существующий файл — обычный и доступен на запись.
+        Возвращает (полный путь, сообщение об ошибке или None).
+        """
+        full_path = self.resolve_path(filename)
+        try:
+            allowed = self.fs.can_create(full_path)
+        except (FileExistsError, FileNotFoundError, NotADirectoryError) as error:
+            return full_path, str(error)
+        if not allowed:
+            return full_path, f"Permission denied: {filename}"
+        node = self.fs.lookup(full_path)
+        if node is not None and (node.is_dir or node.offset is None):
+            return full_path, f"'{filename}' is not a regular file."
+        if node is not None and not self.fs.can_access(node, "write"):
+            return full_path, f"Permission denied: {filename}"
+        return full_path, None
+
+    def touch(self, filename):
+        """
+        Создаёт пустой файл, если его ещё нет.
+        """
+        full_path, error = self._check_writable(filename)
+        if error:
+            return error
+        if self.fs.lookup(full_path) is None:
+            self.fs.write_file(full_path, b"")
+        return ""
+
+    def mkdir(self, args):
+        """
+        mkdir [-p] <директория>...: с -p создаются и недостающие родители, существующие не считаются ошибкой.
+        """
+        parents = "-p" in args
+        directories = [arg for arg in args if arg != "-p"]
+        if not directories:
+            return "Usage: mkdir [-p] <directory>..."
+        messages = []
+        for directory in directories:
+            full_path = self.resolve_path(directory)
+            paths = [full_path]
+            if parents:
+                parts = split_path(full_path)
+                paths = ['/' + '/'.join(parts[:index]) for index in range(1, len(parts) + 1)]
+            for path in paths:
+                node = self.fs.lookup(path)
+                if node is not None:
+                    if parents and node.is_dir:
+                        continue
+                    messages.append(f"mkdir: '{path}' already exists.")
+                    break
+                _, error = self._check_writable(path)
+                if error:
+                    messages.append(f"mkdir: {error}")
+                    break
+                self.fs.make_dir(path)
+        return "\n".join(messages)
+
+    def copy_or_move(self, command):
+        """
+        cp [-r] <источник> <назначение>, mv <источник> <назначение>.
+        Если назначение — существующая директория, копия кладётся в неё под тем же именем.
+        """
+        name, *args = command.split()
+        recursive = name == "cp" and "-r" in args
+        args = [arg for arg in args if not (name == "cp" and arg == "-r")]
+        if len(args) != 2:
+            return "Usage: cp [-r] <source> <destination>" if name == "cp" else "Usage: mv <source> <destination>"
+        source, destination = self.resolve_path(args[0]), self.resolve_path(args[1])
+        node = self.fs.lookup(source)
+        if node is None or node == self.fs.root:
+            return f"{name}: '{args[0]}' not found."
+        if node.is_dir and name == "cp" and not recursive:
+            return f"cp: '{args[0]}' is a directory (use -r)."
+        target = self.fs.lookup(destination)
+        if target is not None and target.is_dir:
+            destination = destination.rstrip('/') + '/' + node.name
+            target = self.fs.lookup(destination)
+        if name == "mv" and not self.fs.can_remove(source):
+            return f"Permission denied: {args[0]}"
+        readable = (node.is_dir and self.fs.can_access(node, "read") and self.fs.is_searchable(node)) \
+            or (not node.is_dir and self.fs.check_path_access(source, "read"))
+        if not readable:
+            return f"Permission denied: {args[0]}"
+        if node.is_dir:
             try:
-                file_obj = tar.extractfile(full_path)
-                if file_obj:
-                    # print(file_obj.read().decode("utf-8"))
-                    return file_obj.read().decode("utf-8")
-                else:
-                    print(f"File '{filename}' is not a regular file.")
-            except KeyError:
-                print(f"File '{filename}' not found in the archive.")
-
-    def run(self):
+                allowed = self.fs.can_create(destination)
+            except OSError as error:
+                return f"{name}: {error}"
+            if not allowed:
+                return f"Permission denied: {args[1]}"
+        else:
+            _, error = self._check_writable(destination)
+            if error:
+                return f"{name}: {error}"
+        try:
+            if name == "mv":
+                self.fs.move(source, destination)
+            else:
+                self.fs.copy(source, destination)
+        except (OSError, ValueError) as error:
+            return f"{name}: {error}"
+        return ""
+
+    def echo(self, args):
+        """
+        echo <текст> [> | >> <файл>]: выводит текст или записывает его в файл (>> — в конец файла).
+        """
+        lexer = shlex.shlex(args, posix=True, punctuation_chars=">")
+        lexer.whitespace_split = True
+        try:
+            words = list(lexer)
+        except ValueError as error:
+            return f"echo: {error}"
+        redirect = None
+        if len(words) >= 2 and words[-2] in (">", ">>"):
+            redirect = words[-2], words[-1]
+            words = words[:-2]
+        text = " ".join(words) + "\n"
+        if redirect is None:
+            return text
+        operator, filename = redirect
+        full_path, error = self._check_writable(filename)
+        if error:
+            return f"echo: {error}"
+        try:
+            self.fs.write_file(full_path, text.encode("utf-8"), append=operator == ">>")
+        except OSError as error:
+            return f"echo: {error}"
+        return ""
+
+    def _check_readable(self, filename):
+        """
+        Проверяет, что файл существует, обычный и доступен на чтение.
+        Ссылки разрешаются: права проверяются и на пути ссылки, и на пути цели.
+        Возвращает (полный путь, сообщение об ошибке или None).
+        """
+        full_path = self.resolve_path(filename)
+        if self.fs.lookup(full_path) is None:
+            return full_path, f"File '{filename}' not found in the archive."
+        try:
+            target = self.fs.resolve_link(full_path)
+        except FileNotFoundError:
+            return full_path, f"File '{filename}' is a broken link."
+        node = self.fs.lookup(target)
+        if node.is_dir or node.offset is None:
+            return full_path, f"File '{filename}' is not a regular file."
+        if not (self.fs.check_path_access(full_path, "read") and self.fs.check_path_access(target, "read")):
+            return full_path, f"No permission to read '{filename}'."
+        return full_path, None
+
+    def cat(self, filename, start=0, end=None):
+        """
+        Выводит содержимое файла (или диапазон байт [start, end)), если у пользователя есть права на чтение.
+        Содержимое отдаётся потоком кусков, а не читается целиком.
+        """
+        full_path, error = self._check_readable(filename)
+        if error:
+            return error
+        return decode_stream(self.fs.iter_file(full_path, start, end))
+
+    def head(self, filename, lines=10):
+        """
+        Выводит первые lines строк файла, читая его только до нужного места.
+        """
+        full_path, error = self._check_readable(filename)
+        if error:
+            return error
+        return decode_stream(take_lines(self.fs.iter_file(full_path), lines))
+
+    def tail(self, filename, lines=10):
+        """
+        Выводит последние lines строк файла; поиск начала идёт с конца данных файла.
+        """
+        full_path, error = self._check_readable(filename)
+        if error:
+            return error
+        start = self.fs.tail_start(full_path, lines)
+        return decode_stream(self.fs.iter_file(full_path, start))
+
+    def commit(self, output=None):
+        """
+        Сохраняет накопленные удаления и изменения прав в архив одной перезаписью.
+        С output (обязателен для нескольких слоёв) результат пишется в новый архив.
+        """
+        try:
+            applied = self.fs.commit(output)
+        except (ValueError, OSError) as error:
+            return f"commit: {error}"
+        if not applied and output is None:
+            return "Nothing to commit."
+        return f"Committed {applied} change(s) to '{self.fs.tar_path}'."
+
+    def compact(self, output=None):
+        """
+        Переписывает архив вместе с журналом, отбрасывая перекрытые записи.
+        """
+        before = sum(os.path.getsize(path) for path in self.fs.layers)
+        try:
+            self.fs.commit(output, compact=True)
+        except (ValueError, OSError) as error:
+            return f"compact: {error}"
+        after = os.path.getsize(self.fs.tar_path)
+        return f"Compacted into '{self.fs.tar_path}': {before} -> {after} bytes."
+
+    def refresh(self):
+        """
+        Перечитывает изменения архива на диске: дописанные записи или, если архив переписан, весь индекс.
+        """
+        try:
+            outcome = self.fs.refresh()
+        except (OSError, tarfile.TarError) as error:
+            return f"Archive refresh failed: {error}"
+        self._refreshed(outcome)
+        if outcome == REFRESH_APPENDED:
+            return "New entries appended to the archive were added to the index."
+        if outcome == REFRESH_RELOADED:
+            return "The archive was rewritten on disk; the index was reloaded."
+        return "The archive has not changed."
+
+    def _refreshed(self, outcome):
+        # Текущая директория могла исчезнуть из архива
+        if outcome == REFRESH_RELOADED and self.fs.lookup(self.current_dir) is None:
+            self.current_dir = '/'
+
+    def stats(self):
+        """
+        Показывает счётчики кэша содержимого файлов, ввода-вывода и время команд.
+        """
+        stats = self.fs.content_cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups * 100 if lookups else 0.0
+        return (f"Content cache: {stats['entries']} file(s), "
+                f"{stats['bytes']} / {stats['capacity']} bytes\n"
+                f"Hits: {stats['hits']}  Misses: {stats['misses']}  "
+                f"Evictions: {stats['evictions']}  Hit rate: {hit_rate:.1f}%\n"
+                + self.fs.tracer.format_report())
+
+    def profile(self, command):
+        """
+        profile [-o <файл>] <команда>: выполняет одну команду под cProfile и выводит
+        её результат и самые затратные функции. С -o статистика сохраняется для pstats/snakeviz.
+        """
+        dump_path = None
+        if command.startswith("-o "):
+            args = command.split(" ", 2)
+            if len(args) != 3:
+                return "Usage: profile [-o <file>] <command>"
+            dump_path, command = args[1], args[2]
+        profiler = cProfile.Profile()
+        output = io.StringIO()
+        try:
+            profiler.enable()
+        except ValueError as error:  # Уже профилируется другая сессия
+            return f"profile: {error}"
+        try:
+            write_result(self.execute_command(command), output)
+        finally:
+            profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        text = output.getvalue() + report.getvalue().strip("\n")
+        if dump_path is not None:
+            profiler.dump_stats(dump_path)
+            text += f"\nProfile saved to '{dump_path}'."
+        return text
+
+    def trace(self, args):
+        """
+        trace on|off|clear|export <файл> [json|chrome]: управление журналом событий.
+        """
+        tracer = self.fs.tracer
+        if args == ["on"]:
+            tracer.tracing = True
+            return "Tracing enabled."
+        if args == ["off"]:
+            tracer.tracing = False
+            return "Tracing disabled."
+        if args == ["clear"]:
+            tracer.reset()
+            return "Counters and trace events cleared."
+        if len(args) in (2, 3) and args[0] == "export":
+            fmt = args[2] if len(args) == 3 else "chrome"
+            try:
+                tracer.export(args[1], fmt)
+            except (OSError, ValueError) as error:
+                return f"trace: {error}"
+            return f"Trace exported to '{args[1]}' ({fmt})."
+        state = "on" if tracer.tracing else "off"
+        return f"Tracing is {state}. Usage: trace on|off|clear|export <file> [json|chrome]"
+
+    def complete(self, line, text):
+        """
+        Варианты дополнения слова text в конце строки line: имя команды для первого слова,
+        иначе путь. Пути дополняются по индексу директории, к директориям добавляется '/'.
+        """
+        if not line[:len(line) - len(text)].strip():
+            return [name + " " for name in COMMANDS if name.startswith(text)]
+        directory, slash, prefix = text.rpartition('/')
+        full_path = self.resolve_path(directory or ('/' if slash else '.'))
+        node = self.fs.lookup(full_path)
+        if node is None or not node.is_dir or not self.fs.check_path_access(full_path, "read") \
+                or not self.fs.is_searchable(node):
+            return []
+        head = directory + slash
+        return [head + name + ('/' if node.children[name].is_dir else ' ')
+                for name in self.fs.complete(full_path, prefix, MAX_COMPLETIONS)]
+
+    def _readline_completer(self, text, state):
+        if state == 0:
+            try:
+                self._completions = self.complete(readline.get_line_buffer()[:readline.get_endidx()], text)
+            except Exception:  # Ошибка в дополнении не должна ронять оболочку
+                self._completions = []
+        return self._completions[state] if state < len(self._completions) else None
+
+    def _setup_readline(self, history_path):
+        readline.set_completer(self._readline_completer)
+        readline.set_completer_delims(" \t\n")  # Путь с '/' дополняется как одно слово
+        if "libedit" in (readline.__doc__ or ""):
+            readline.parse_and_bind("bind ^I rl_complete")  # readline на macOS
+        else:
+            readline.parse_and_bind("tab: complete")
+        readline.set_history_length(HISTORY_LENGTH)
+        if history_path:
+            try:
+                readline.read_history_file(history_path)
+            except OSError:
+                pass  # Первый запуск: истории ещё нет
+
+    def run(self, history_path=HISTORY_FILE):
+        """
+        Интерактивный режим. С модулем readline работают дополнение команд и путей по Tab
+        и история, которая сохраняется в history_path между запусками.
+        Ctrl-C прерывает ввод строки или выполнение команды, но не сессию.
+        """
+        if readline is not None:
+            self._setup_readline(history_path)
+        try:
+            while self.running:
+                try:
+                    command = input(self.prompt())
+                except EOFError:
+                    print()
+                    break
+                except KeyboardInterrupt:
+                    print()
+                    continue
+                try:
+                    write_result(self.execute_command(command))
+                except KeyboardInterrupt:
+                    print("\nInterrupted.")
+        finally:
+            if readline is not None and history_path:
+                try:
+                    readline.write_history_file(history_path)
+                except OSError:
+                    pass
+
+    def run_batch(self, commands):
+        """
+        Выполняет команды без приглашения и возвращает список BatchResult
+        (команда, вывод, время выполнения в секундах). Пустые строки и комментарии '#' пропускаются.
+        """
+        results = []
+        for line in commands:
+            command = line.rstrip("\r\n")
+            if not command.strip() or command.lstrip().startswith("#"):
+                continue
+            started = time.perf_counter()
+            output = self.execute_command(command)
+            if output is not None and not isinstance(output, str):
+                output = "".join(output)  # В пакетном режиме вывод буферизуется
+            results.append(BatchResult(command, output, time.perf_counter() - started))
+            if not self.running:
+                break
+        return results
+
+
+def take_flag(args, flags):
+    """
+    Отделяет ведущий флаг из flags от остальной строки аргументов: (есть ли флаг, остаток).
+    """
+    option, _, rest = args.partition(" ")
+    if option in flags:
+        return True, rest
+    return False, args
+
+
+def join_results(results):
+    """
+    Склеивает результаты нескольких команд (строки и потоки) в один поток.
+    """
+    for result in results:
+        if not result:
+            continue
+        if isinstance(result, str):
+            yield result if result.endswith("\n") else result + "\n"
+        else:
+            yield from result
+
+
+def split_flags(args):
+    """
+    Разделяет аргументы на однобуквенные флаги (в том числе слитные, как -la) и операнды.
+    """
+    flags = set()
+    operands = []
+    for arg in args:
+        if arg.startswith("-") and len(arg) > 1:
+            flags.update(arg[1:])
+        else:
+            operands.append(arg)
+    return flags, operands
+
+
+def file_type(node):
+    return "d" if node.is_dir else "l" if node.is_symlink else "-"
+
+
+def format_time(mtime):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))
+
+
+def format_long(node, size=None):
+    """
+    Строка ls -l в стиле tar -tv: тип и права, владелец/группа, размер, время изменения, имя
+    (у символической ссылки — с целью). size заменяет размер узла (см. ShellEmulator._display_size).
+    """
+    size = node.size if size is None else size
+    name = f"{node.name} -> {node.link_target}" if node.is_symlink else node.name
+    return (f"{file_type(node)}{format_mode(node.mode)} {node.owner}/{node.group} "
+            f"{size:>10} {format_time(node.mtime)} {name}")
+
+
+def format_size(size):
+    """
+    Размер в единицах K/M/G/T (основание 1024), как du -h: одна цифра после запятой для значений меньше 10.
+    """
+    if size < 1024:
+        return str(size)
+    for unit in "KMGT":
+        size /= 1024
+        if size < 1024 or unit == "T":
+            return f"{size:.1f}{unit}" if size < 10 else f"{size:.0f}{unit}"
+
+
+def decode_stream(chunks):
+    """
+    Декодирует поток байтов в UTF-8 по кускам, не разрывая многобайтовые символы.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def take_lines(chunks, lines):
+    """
+    Пропускает куски, пока не наберётся lines строк, и обрезает последний кусок.
+    """
+    if lines <= 0:
+        return
+    for chunk in chunks:
+        start = 0
         while True:
-            command = input(self.prompt())
-            result = self.execute_command(command)
-            if result:
-                print(result)
+            index = chunk.find(b"\n", start)
+            if index < 0:
+                break
+            lines -= 1
+            if not lines:
+                yield chunk[:index + 1]
+                return
+            start = index + 1
+        yield chunk
+
+
+def parse_byte_range(text):
+    """
+    Разбирает диапазон вида start:end, любая из границ может быть опущена.
+    """
+    start, end = text.split(":", 1)
+    start = int(start) if start else 0
+    end = int(end) if end else None
+    if start < 0 or (end is not None and end < start):
+        raise ValueError(f"Invalid range: {text}")
+    return start, end
+
+
+def write_result(result, out=None):
+    """
+    Печатает результат команды: строку целиком или поток кусков по мере их чтения.
+    """
+    if out is None:
+        out = sys.stdout
+    if not result:
+        return
+    if isinstance(result, str):
+        out.write(result + "\n")
+        return
+    last = ""
+    for chunk in result:
+        out.write(chunk)
+        last = chunk
+    if last and not last.endswith("\n"):
+        out.write("\n")
+    out.flush()
+
+
+def format_batch_report(results, elapsed):
+    """
+    Сводка пакетного режима: задержки по видам команд и общая пропускная способность.
+    """
+    by_name = {}
+    for result in results:
+        by_name.setdefault(result.command.split(" ", 1)[0], []).append(result.seconds)
+    lines = [f"{'command':<10}{'count':>8}{'mean ms':>12}{'p95 ms':>12}{'max ms':>12}"]
+    for name, timings in sorted(by_name.items()):
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        lines.append(f"{name:<10}{len(timings):>8}{sum(timings) / len(timings) * 1000:>12.3f}"
+                     f"{p95 * 1000:>12.3f}{timings[-1] * 1000:>12.3f}")
+    rate = len(results) / elapsed if elapsed > 0 else float("inf")
+    lines.append(f"{len(results)} commands in {elapsed:.3f} s ({rate:.1f} commands/s)")
+    return "\n".join(lines)
+
+
+def add_common_arguments(parser):
+    """
+    Параметры, общие для оболочки и сервера: архивы, пользователь, кэш, разбор индекса и трассировка.
+    """
+    parser.add_argument("fs_archive", nargs="+",
+                        help="Tar archive(s) of the virtual file system; several archives are mounted "
+                             "as layers, later ones shadowing earlier ones")
+    parser.add_argument("--index-workers", type=int, default=None, metavar="N",
+                        help="Processes parsing headers of large uncompressed archives "
+                             "(default: number of CPUs, 1 disables parallel indexing)")
+    parser.add_argument("--uid", type=int, default=None,
+                        help="Numeric user id for permission checks (default: owner of every file)")
+    parser.add_argument("--gid", type=int, default=None,
+                        help="Numeric group id for permission checks")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE >> 20, metavar="MB",
+                        help="Memory budget of the file content cache in MiB (0 disables it)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Record trace events from startup and export them to FILE on exit")
+    parser.add_argument("--trace-format", choices=EXPORT_FORMATS, default="chrome",
+                        help="Format of the --trace file: Chrome trace events or a JSON summary")
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Shell emulator")
-    parser.add_argument("fs_archive", help="Path to the tar archive of the virtual file system")
+    add_common_arguments(parser)
+    parser.add_argument("--lazy", action="store_true",
+                        help="Build the file index in the background and start the shell immediately")
+    parser.add_argument("--no-index-cache", action="store_true",
+                        help="Do not read or write the <archive>.idx index file")
+    parser.add_argument("--history", default=HISTORY_FILE, metavar="FILE",
+                        help="Interactive command history file ('' disables saving history)")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="Check the archive on disk for changes before commands, at most every SECONDS")
+    parser.add_argument("--script", metavar="FILE",
+                        help="Run commands from FILE without prompts and print a latency report")
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    emulator = ShellEmulator(args.fs_archive)
-    emulator.run()
+    emulator = ShellEmulator(args.fs_archive, lazy=args.lazy,
+                             use_index_cache=not args.no_index_cache,
+                             uid=args.uid, gid=args.gid, cache_size=args.cache_size << 20,
+                             tracer=Tracer(tracing=args.trace is not None),
+                             index_workers=args.index_workers, watch=args.watch)
+    if args.lazy and emulator.fs.waits_full_load():
+        print("Lazy loading: the archive has several layers (or a journal of uncommitted changes), "
+              "commands wait until the whole index is loaded.", file=sys.stderr)
+    try:
+        run_emulator(emulator, args)
+    finally:
+        if args.trace is not None:
+            emulator.fs.tracer.export(args.trace, args.trace_format)
+
+
+def run_emulator(emulator, args):
+    if args.script is None and sys.stdin.isatty():
+        emulator.run(args.history)
+        return
+
+    # Пакетный режим: команды из файла или из stdin, вывод буферизуется и печатается в конце
+    if args.script is not None:
+        with open(args.script, encoding="utf-8") as script:
+            commands = script.readlines()
+    else:
+        commands = sys.stdin.readlines()
+    started = time.perf_counter()
+    results = emulator.run_batch(commands)
+    elapsed = time.perf_counter() - started
+
+    output = io.StringIO()
+    for result in results:
+        if result.output:
+            output.write(result.output)
+            if not result.output.endswith("\n"):  # Потоковый вывод уже завершён переводом строки
+                output.write("\n")
+    sys.stdout.write(output.getvalue())
+    print(format_batch_report(results, elapsed), file=sys.stderr)
 
 
 if __name__ == "__main__":
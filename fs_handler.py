@@ -1,297 +1,1713 @@
+import bisect
+import errno
+import io
+import itertools
 import tarfile
+import fnmatch
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 from stat import S_IMODE, S_IRUSR, S_IWUSR, S_IXUSR, S_IRGRP, S_IWGRP, S_IXGRP, S_IROTH, S_IWOTH, S_IXOTH
 
+from archive_io import open_archive
+from index_cache import IndexColumns, fingerprint, load_index, read_index, save_index
+from instrumentation import Tracer
+from journal import Journal, journal_path
+from node_table import HARD_LINK, IS_DIR, NAME_ENCODING, NO_NODE, ROOT, FsNode, NodeTable
+from parallel_index import build_rows, can_parallelize, member_row
+
+
+def split_path(path):
+    """
+    Разбивает путь на компоненты, отбрасывая пустые части и '.'.
+    """
+    return [part for part in path.split('/') if part and part != '.']
+
+
+GLOB_MAGIC = re.compile(r"[*?[]")
+
+
+def has_glob(path):
+    return GLOB_MAGIC.search(path) is not None
+
+
+@lru_cache(maxsize=256)
+def compile_glob(pattern):
+    """
+    Компилирует шаблон оболочки (*, ?, [...]) в функцию сопоставления имени.
+    """
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+PERMISSION_FLAGS = (
+    S_IRUSR, S_IWUSR, S_IXUSR,
+    S_IRGRP, S_IWGRP, S_IXGRP,
+    S_IROTH, S_IWOTH, S_IXOTH
+)
+# Маски прав для (владелец, группа, остальные) по каждой операции
+ACCESS_MASKS = {
+    "read": (S_IRUSR, S_IRGRP, S_IROTH),
+    "write": (S_IWUSR, S_IWGRP, S_IWOTH),
+    "execute": (S_IXUSR, S_IXGRP, S_IXOTH),
+}
+USER_ROLES = {"user": 0, "group": 1, "other": 2}
+WHITEOUT_PREFIX = ".wh."  # Удаление файла нижнего слоя (как в overlayfs/OCI)
+OPAQUE_WHITEOUT = ".wh..wh..opq"  # Директория верхнего слоя скрывает содержимое нижних
+MAX_LINK_DEPTH = 40  # Длина цепочки ссылок, после которой она считается петлёй (как SYMLOOP_MAX)
+CHUNK_SIZE = 1 << 16  # Размер куска при потоковом чтении файлов
+DEFAULT_CACHE_SIZE = 32 << 20  # Бюджет кэша содержимого файлов в байтах
+LISTING_CACHE_SIZE = 64  # Сколько отсортированных списков детей директорий держать в памяти
+# Результаты VirtualFileSystem.refresh()
+REFRESH_UNCHANGED = "unchanged"
+REFRESH_APPENDED = "appended"
+REFRESH_RELOADED = "reloaded"
+NEW_FILE_MODE = 0o644
+NEW_DIR_MODE = 0o755
+
+
+def format_mode(mode):
+    """
+    Преобразует биты прав доступа (mode) в строку rwxrwxrwx.
+    """
+    return "".join(char if mode & flag else "-"
+                   for flag, char in zip(PERMISSION_FLAGS, "rwxrwxrwx"))
+
+
+def parse_mode(text):
+    """
+    Разбирает права в восьмеричной записи ("755", "0644") или в виде строки rwxrwxrwx.
+    """
+    if text.isdigit() and len(text) <= 4 and all(char < "8" for char in text):
+        return int(text, 8)
+    if len(text) == 9 and all(char in (flag_char, "-") for char, flag_char in zip(text, "rwxrwxrwx")):
+        mode = 0
+        for flag, char in zip(PERMISSION_FLAGS, text):
+            if char != "-":
+                mode |= flag
+        return mode
+    raise ValueError(f"Invalid mode: {text}")
+
+
+class ReadWriteLock:
+    """
+    Блокировка "много читателей / один писатель" с приоритетом писателей.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class ContentCache:
+    """
+    LRU-кэш содержимого файлов с ограничением по суммарному размеру в байтах.
+    Файлы крупнее четверти бюджета не кэшируются, чтобы один большой cat не вытеснял всё остальное.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.max_entry = capacity // 4
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_entry:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.capacity:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """
+        Удаляет из кэша путь и всё, что лежит под ним.
+        """
+        prefix = path + "/"
+        with self._lock:
+            for key in [key for key in self._entries if key == path or key.startswith(prefix)]:
+                self.size -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self.size, "capacity": self.capacity}
+
+
+# Файл слоя на момент разбора: identity — (устройство, inode), fingerprint — отпечаток из index_cache,
+# end — конец последней записи, boundary — первый блок и блок перед end (None у сжатых архивов)
+LayerState = namedtuple("LayerState", ["identity", "fingerprint", "end", "boundary"])
+
+# Сведения о файле для библиотечного API: path с ведущим '/', mode — только биты прав
+FileStat = namedtuple("FileStat", ["path", "name", "is_dir", "is_file", "mode", "size",
+                                   "uid", "gid", "owner", "group", "mtime"])
+
+
+class ArchiveFile(io.RawIOBase):
+    """
+    Файл архива только для чтения (результат VirtualFileSystem.open без буферизации).
+    Каждое чтение — позиционное чтение архива слоя по смещению данных узла, поэтому
+    файлы можно читать из многих потоков одновременно. Смещения берутся из узла при каждом
+    чтении, так что после commit() открытый файл продолжает читаться из нового архива.
+    Если файл удалён и изменения записаны или индекс перестроен целиком (refresh() после
+    перезаписи архива), смещения узла относятся к прежнему архиву: чтение завершается OSError(ESTALE).
+    """
+    def __init__(self, fs, node):
+        super().__init__()
+        self._fs = fs
+        self._node = node
+        self._generation = node.table.generation
+        self._position = 0
+        self.name = '/' + node.path()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._node.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError(f"Negative seek position: {offset}")
+        self._position = offset
+        return offset
+
+    def _read(self, size):
+        node = self._node
+        self._generation = self._fs._check_generation(node, self._generation, self.name)
+        size = min(size, node.size - self._position)
+        if size <= 0 or node.offset is None:
+            return b""
+        data = self._fs._cached_content(node)
+        if data is not None:
+            data = data[self._position:self._position + size]
+        else:
+            data = self._fs._read_at(node.offset + self._position, size, node.layer)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self._read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return self._read(self._node.size - self._position)
+
+
+def child_path(parent, name):
+    """
+    Путь (без ведущего '/') для имени name внутри директории parent.
+    """
+    base = parent.path()
+    return f"{base}/{name}" if base else name
+
 
 class VirtualFileSystem:
-    def __init__(self, tar_path):
-        self.tar_path = tar_path
-        self.metadata = {}  # Метаданные файлов
-        self._load_metadata()
+    def __init__(self, tar_path, lazy=False, use_index_cache=True, uid=None, gid=None,
+                 cache_size=DEFAULT_CACHE_SIZE, tracer=None, index_workers=None):
+        # Несколько архивов монтируются слоями: более поздние перекрывают более ранние
+        self.layers = [tar_path] if isinstance(tar_path, (str, os.PathLike)) else list(tar_path)
+        if not self.layers:
+            raise ValueError("At least one archive is required.")
+        self.tar_path = self.layers[-1]
+        self.base_layers = list(self.layers)  # Слои без журнала изменений
+        # Текущий пользователь для проверки прав; uid=None — владелец всех файлов
+        self.uid = uid
+        self.gid = gid
+        # Дерево хранится колонками в NodeTable, узлы (FsNode) — лёгкие представления его строк
+        self.nodes = NodeTable()
+        self.root = FsNode(self.nodes, ROOT)  # Корень дерева файловой системы
+        self._directory_ids = {}  # Путь -> номер директории для добавления записей; сбрасывается при удалениях
+        # Счётчики и таймеры ввода-вывода; журнал событий ведётся, если tracer.tracing включён
+        self.tracer = tracer if tracer is not None else Tracer()
+        # Архивы открываются один раз на всё время работы; сжатые читаются через индекс точек
+        self._archives = []
+        for path in self.layers:
+            self._archives.append(self._open_archive(path))
+        # Журнал записей (<архив>.journal) монтируется самым верхним слоем; создаётся при первой записи
+        self._journal = None
+        self._journal_layer = None
+        if os.path.exists(journal_path(self.tar_path)):
+            self._attach_journal()
+        # Для совместного использования несколькими сессиями: изменения дерева под write()
+        self.lock = ReadWriteLock()
+        # Содержимое часто читаемых небольших файлов, ключ — путь без ведущего '/'
+        self.content_cache = ContentCache(cache_size)
+        # Отсортированные имена детей недавно просмотренных директорий (ls, дополнение путей)
+        self._listings = OrderedDict()
+        self._listings_lock = threading.Lock()
+        # Оверлей поверх архива: удалённые пути и изменённые права до commit()
+        self.whiteouts = {}  # Путь -> длина журнала на момент удаления (что записано позже, не удаляется)
+        self.changed_modes = {}
+        # В ленивом режиме индекс строится в фоновом потоке, а команды ждут только нужные им узлы
+        self._loaded = threading.Event()
+        self._load_error = None
+        self._progress = threading.Condition()
+        # Суммы поддеревьев считаются после загрузки, дальше поддерживаются при каждом изменении дерева
+        self._totals_ready = False
+        # Слой -> LayerState: по нему refresh() отличает дописывание архива от замены
+        self._layer_states = {}
+        # Тёплый старт: индекс слоя из <архив>.idx, если он соответствует архиву
+        self.use_index_cache = use_index_cache
+        # Число процессов для разбора заголовков больших архивов; 1 — всегда последовательно
+        self.index_workers = index_workers or os.cpu_count() or 1
+        if lazy:
+            threading.Thread(target=self._load_in_background, daemon=True).start()
+        else:
+            self._load_metadata()
+            self._loaded.set()
+
+    def close(self):
+        for archive in self._archives:
+            archive.close()
+        if self._journal is not None:
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _open_archive(self, path):
+        self.tracer.count("archive_opens")
+        return open_archive(path)
+
+    def _attach_journal(self):
+        """
+        Открывает (или создаёт) журнал текущего архива и добавляет его верхним слоем.
+        """
+        self._journal = Journal(journal_path(self.tar_path))  # Восстановление после сбоя — до чтения
+        self.layers.append(self._journal.path)
+        self._archives.append(self._open_archive(self._journal.path))
+        self._journal_layer = len(self.layers) - 1
+        return self._journal
+
+    def _read_at(self, offset, size, layer=0):
+        """
+        Читает size байт (несжатого) архива слоя layer начиная с offset одним позиционным чтением.
+        """
+        started = time.perf_counter()
+        data = self._archives[layer].pread(offset, size)
+        self.tracer.record_read(started, len(data))
+        return data
+
+    def resolve_link(self, path):
+        """
+        Путь, на который указывает ссылка path (по всей цепочке ссылок), или сам path.
+        Цель жёсткой ссылки отсчитывается от корня, символической — от директории ссылки,
+        как при tarfile.extractfile(). Висячая ссылка или петля — FileNotFoundError.
+        """
+        for _ in range(MAX_LINK_DEPTH):
+            node = self.lookup(path)
+            if node is None:
+                raise FileNotFoundError(f"File '{path}' does not exist.")
+            link = node.table.links.get(node.id)
+            if link is None:
+                return path
+            base = '/' if link[0] == HARD_LINK else os.path.dirname('/' + node.path())
+            path = os.path.join(base, link[1:])
+        raise FileNotFoundError(f"Too many levels of links: '{path}'.")
+
+    def _regular_node(self, path):
+        node = self.lookup(self.resolve_link(path))
+        if node is None:
+            raise FileNotFoundError(f"File '{path}' does not exist.")
+        if node.is_dir or node.offset is None:
+            raise IsADirectoryError(f"'{path}' is not a regular file.")
+        return node
+
+    def _check_generation(self, node, generation, path):
+        """
+        Проверяет узел, прочитанный в поколении смещений generation, и возвращает текущее поколение.
+        После commit узлы, оставшиеся в дереве, получили смещения в новом архиве и читаются дальше;
+        узлы прежней таблицы (полная перестройка индекса) и отцепленные узлы описывают
+        смещения прежнего архива, читать по ним нельзя — OSError(ESTALE).
+        """
+        table = self.nodes
+        if generation == table.generation:
+            return generation
+        if node.table is not table or not table.attached(node.id):
+            raise OSError(errno.ESTALE, f"Stale file handle: '{path}' changed on disk.")
+        return table.generation
+
+    def _cached_content(self, node):
+        """
+        Возвращает содержимое файла через кэш или None, если файл слишком велик для кэша.
+        Кэш ключуется путём, поэтому узлы устаревшего дерева его не читают и не пополняют.
+        """
+        self._check_generation(node, node.table.generation, node.path())
+        if node.size > self.content_cache.max_entry:
+            return None
+        key = node.path()
+        data = self.content_cache.get(key)
+        if data is None:
+            data = self._read_at(node.offset, node.size, node.layer)
+            if node.table is self.nodes:  # Индекс могли перестроить, пока шло чтение
+                self.content_cache.put(key, data)
+        return data
+
+    def read_file(self, path):
+        """
+        Возвращает содержимое обычного файла в байтах, используя индекс смещений.
+        """
+        node = self._regular_node(path)
+        data = self._cached_content(node)
+        return data if data is not None else self._read_at(node.offset, node.size, node.layer)
+
+    def iter_file(self, path, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """
+        Отдаёт байты файла из диапазона [start, end) кусками не больше chunk_size,
+        так что память не зависит от размера файла. Если между кусками смещения узла
+        устарели (см. ArchiveFile), следующий кусок не читается: OSError(ESTALE).
+        """
+        node = self._regular_node(path)
+        generation = node.table.generation
+        end = node.size if end is None else min(end, node.size)
+        position = max(start, 0)
+        data = self._cached_content(node)
+        if data is not None:
+            for offset in range(position, end, chunk_size):
+                yield data[offset:min(offset + chunk_size, end)]
+            return
+        while position < end:
+            generation = self._check_generation(node, generation, path)
+            chunk = self._read_at(node.offset + position, min(chunk_size, end - position), node.layer)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+
+    def tail_start(self, path, lines, chunk_size=CHUNK_SIZE):
+        """
+        Возвращает смещение внутри файла, с которого начинаются последние lines строк.
+        Файл читается блоками с конца, завершающий перевод строки не считается.
+        """
+        node = self._regular_node(path)
+        if lines <= 0:
+            return node.size
+        data = self._cached_content(node)
+        if data is not None:
+            index = len(data) - 1 if data.endswith(b"\n") else len(data)
+            for _ in range(lines):
+                index = data.rfind(b"\n", 0, index)
+                if index < 0:
+                    return 0
+            return index + 1
+        end = node.size
+        if end and self._read_at(node.offset + end - 1, 1, node.layer) == b"\n":
+            end -= 1
+        position = end
+        found = 0
+        while position > 0:
+            size = min(chunk_size, position)
+            position -= size
+            block = self._read_at(node.offset + position, size, node.layer)
+            index = len(block)
+            while True:
+                index = block.rfind(b"\n", 0, index)
+                if index < 0:
+                    break
+                found += 1
+                if found == lines:
+                    return position + index + 1
+        return 0
+
+    def lookup(self, path):
+        """
+        Находит узел по пути, спускаясь по дереву. Возвращает None, если пути нет.
+        Пока индекс строится, ждёт появления узла или окончания загрузки.
+        При нескольких слоях (в том числе при журнале незакоммиченных изменений) ждёт окончания
+        загрузки целиком: узел нижнего слоя ещё может быть перекрыт или удалён верхним.
+        """
+        if self.waits_full_load() and not self._loaded.is_set():
+            self.wait_loaded()
+            return self._find(path)
+        node = self._find(path)
+        if node is None and not self._loaded.is_set():
+            with self._progress:
+                while node is None and not self._loaded.is_set():
+                    self._progress.wait()
+                    node = self._find(path)
+            if self._load_error is not None:
+                raise self._load_error
+        return node
+
+    def _find(self, path):
+        node = self._find_id(path)
+        return None if node == NO_NODE else FsNode(self.nodes, node)
+
+    def _find_id(self, path):
+        table = self.nodes
+        node = ROOT
+        for part in split_path(path):
+            if part == '..':
+                parent = table.parents[node]
+                node = node if parent == NO_NODE else parent
+                continue
+            if not table.flags[node] & IS_DIR:
+                return NO_NODE
+            node = table.child(node, part)
+            if node == NO_NODE:
+                return NO_NODE
+        return node
+
+    def list_dir(self, path):
+        """
+        Возвращает отсортированные имена дочерних элементов директории.
+        """
+        self.wait_loaded()  # Полный список детей известен только после загрузки
+        node = self.lookup(path)
+        if node is None or not node.is_dir:
+            raise NotADirectoryError(f"Directory '{path}' does not exist.")
+        return list(self.sorted_children(node))
+
+    def sorted_children(self, directory):
+        """
+        Отсортированные имена детей директории (список только для чтения).
+        Список сортируется один раз и хранится, пока директория не изменится.
+        """
+        with self._listings_lock:
+            names = self._listings.get(directory)
+            if names is not None:
+                self._listings.move_to_end(directory)
+                return names
+        names = sorted(directory.children)
+        with self._listings_lock:
+            self._listings[directory] = names
+            if len(self._listings) > LISTING_CACHE_SIZE:
+                self._listings.popitem(last=False)
+        return names
+
+    def _children_changed(self, directory):
+        with self._listings_lock:
+            self._listings.pop(directory, None)
+
+    def complete(self, path, prefix, limit=None):
+        """
+        Имена детей директории path, начинающиеся с prefix: двоичный поиск
+        по отсортированному списку, так что время зависит от числа совпадений, а не от размера директории.
+        Скрытые имена (с '.') возвращаются, только если prefix тоже начинается с '.'.
+        """
+        self.wait_loaded()
+        node = self.lookup(path)
+        if node is None or not node.is_dir:
+            return []
+        names = self.sorted_children(node)
+        matches = []
+        for index in range(bisect.bisect_left(names, prefix), len(names)):
+            name = names[index]
+            if not name.startswith(prefix) or (limit is not None and len(matches) >= limit):
+                break
+            if prefix.startswith('.') or not name.startswith('.'):
+                matches.append(name)
+        return matches
 
     def remove_file(self, full_path):
         """
-        Удаляет файл или папку из архива.
-        """
-        #print(full_path + "PATH")
-        if full_path[-1] == '/':
-            full_path = full_path[:-1]
-        with tarfile.open(self.tar_path, "r") as tar:
-            if full_path not in tar.getnames():
-                #print(tar.getnames())
-                raise FileNotFoundError(f"File or directory '{full_path}' does not exist.")
-
-        temp_tar_path = self.tar_path + ".tmp"
-        with tarfile.open(self.tar_path, "r") as tar, tarfile.open(temp_tar_path, "w") as new_tar:
-            for member in tar.getmembers():
-                if member.name == full_path or member.name.startswith(full_path + "/"):
-                    continue  # Пропускаем удаляемые файлы и папки
-                file_obj = tar.extractfile(member)
-                if file_obj:
-                    new_tar.addfile(member, file_obj)
-                else:
-                    new_tar.addfile(member)
-
-        os.replace(temp_tar_path, self.tar_path)
-
-    # def remove_file(self, full_path):
-    #     """
-    #     Удаляет файл, если разрешение позволяет это сделать.
-    #     """
-    #     if not self.file_has_permission(full_path, "write"):
-    #         raise PermissionError(f"No permission to remove '{full_path}'.")
-    #
-    #     with tarfile.open(self.tar_path, "r") as tar:
-    #         if full_path not in tar.getnames():
-    #             raise FileNotFoundError(f"File '{full_path}' does not exist.")
-    #
-    #     # Создаём временный архив
-    #     temp_tar_path = self.tar_path + ".tmp"
-    #
-    #     with tarfile.open(self.tar_path, "r") as tar, tarfile.open(temp_tar_path, "w") as new_tar:
-    #         for member in tar.getmembers():
-    #             if member.name == full_path:
-    #                 continue  # Пропускаем файл, который нужно удалить
-    #             file_obj = tar.extractfile(member)
-    #             if file_obj:
-    #                 new_tar.addfile(member, file_obj)
-    #             else:
-    #                 new_tar.addfile(member)
-    #
-    #     os.replace(temp_tar_path, self.tar_path)
-    #     del self.metadata[full_path]
-    #     print(f"File '{full_path}' successfully removed.")
-
-    def remove_duplicate_dirs(self):
-        updated_metadata = {}
-
-        for key, value in self.metadata.items():
-            # Определяем базовое имя директории
-            normalized_key = key.rstrip('/')
-            if normalized_key in updated_metadata:
-                # Если дубликат уже добавлен, сравниваем права доступа и оставляем более строгие
-                existing_perms = updated_metadata[normalized_key]['permissions']
-                current_perms = value['permissions']
-                if existing_perms > current_perms:  # Строгость прав
-                    continue
-            updated_metadata[normalized_key] = value
-
-        return updated_metadata
-
-    def _load_metadata(self):
-        """
-        Загружает метаданные файлов и директорий из TAR.
-        """
-        with tarfile.open(self.tar_path, "r") as tar:
-            directories = set()
-            for member in tar.getmembers():
-                # Обработка файла
-                permissions = self._decode_permissions(member.mode)
-                self.metadata[member.name] = {
-                    "permissions": permissions,
-                    "owner": member.uname or "root",
-                    "group": member.gname or "root",
-                    "is_dir": member.isdir(),
-                }
-
-                # Сохраняем все родительские директории
-                path_parts = member.name.split('/')
-                for i in range(1, len(path_parts)):
-                    directories.add('/'.join(path_parts[:i]) + '/')
-
-            # Добавляем директории в метаданные
-            for directory in directories:
-                if directory not in self.metadata:
-                    self.metadata[directory] = {
-                        "permissions": "rwxr-xr-x",  # Стандартные права для папок
-                        "owner": "root",
-                        "group": "root",
-                        "is_dir": True,
-                    }
-            self.metadata = self.remove_duplicate_dirs()
-
-    # def _load_metadata(self):
-    #     """
-    #     Загружает метаданные файлов из TAR.
-    #     """
-    #     with tarfile.open(self.tar_path, "r") as tar:
-    #         for member in tar.getmembers():
-    #             # Декодируем права доступа
-    #             permissions = self._decode_permissions(member.mode)
-    #             self.metadata[member.name] = {
-    #                 "permissions": permissions,
-    #                 "owner": member.uname or "root",
-    #                 "group": member.gname or "root",
-    #                 "is_dir": member.isdir()
-    #             }
-
-    def _decode_permissions(self, mode):
-        """
-        Преобразует число прав доступа (mode) в строку rwxrwxrwx.
-        """
-        flags = [
-            S_IRUSR, S_IWUSR, S_IXUSR,
-            S_IRGRP, S_IWGRP, S_IXGRP,
-            S_IROTH, S_IWOTH, S_IXOTH
-        ]
-        chars = ["r", "w", "x"]
-        perms = []
-        for flag in flags:
-            perms.append(chars[flags.index(flag) % 3] if mode & flag else "-")
-        return "".join(perms)
-
-    # def file_has_permission(self, filename, operation, user="user"):
-    #     """
-    #     Проверяет, имеет ли пользователь право на операцию (read, write, execute).
-    #     """
-    #     if filename not in self.metadata:
-    #         raise FileNotFoundError(f"File '{filename}' does not exist.")
-    #
-    #     file_metadata = self.metadata[filename]
-    #     permissions = file_metadata["permissions"]
-    #
-    #     user_roles = {"user": 0, "group": 1, "other": 2}
-    #     role = user_roles.get(user, 2)  # Если роль не определена, считать "другие"
-    #     offsets = {"read": 0, "write": 1, "execute": 2}
-    #
-    #     # Позиция в строке rwxrwxrwx
-    #     pos = role * 3 + offsets[operation]
-    #     return permissions[pos] != "-"
-    def file_has_permission(self, filename, operation, user="user"):
+        Удаляет файл или папку. Архив не трогается: путь попадает в оверлей
+        как whiteout и исчезнет из архива только при commit().
         """
-        Проверяет, имеет ли пользователь право на операцию (read, write, execute).
+        self.wait_loaded()
+        node = self.lookup(full_path)
+        if node is None or node == self.root:
+            raise FileNotFoundError(f"File or directory '{full_path}' does not exist.")
+        self.whiteouts[node.path()] = self._journal.end if self._journal is not None else 0
+        self._discard(node)
+
+    def _discard(self, node):
+        """
+        Убирает удалённое или перенесённое поддерево: кэш его содержимого и изменения прав
+        внутри него больше не нужны.
+        """
+        path = node.path()
+        self.content_cache.invalidate(path)
+        self.changed_modes = {key: value for key, value in self.changed_modes.items()
+                              if key != path and not key.startswith(path + "/")}
+        self._detach(node)
+
+    def _detach(self, node):
+        """
+        Отцепляет поддерево от дерева целиком и вычитает его из сумм родительских директорий.
+        """
+        parent = node.parent
+        self._children_changed(parent)
+        self.nodes.detach(node.id)
+        self._directory_ids.clear()
+        if self._totals_ready:
+            size, count = node.totals()
+            self._adjust_totals(parent, -size, -count)
+
+    def _adjust_totals(self, directory, size, count):
+        """
+        Переносит изменение размера поддерева на все директории от directory до корня: O(глубины).
+        """
+        table = self.nodes
+        node = directory.id
+        while node != NO_NODE:
+            totals = table.totals[node]
+            totals[0] += size
+            totals[1] += count
+            node = table.parents[node]
+
+    def _compute_totals(self):
+        """
+        Считает суммы поддеревьев за один проход снизу вверх: номер ребёнка всегда больше
+        номера родителя, поэтому при проходе по убыванию номеров дети встречаются раньше родителей.
+        Отцепленные поддеревья в суммы живого дерева не попадают.
+        """
+        table = self.nodes
+        totals, parents, flags, sizes = table.totals, table.parents, table.flags, table.sizes
+        for node_totals in totals.values():
+            node_totals[0] = node_totals[1] = 0
+        for node in range(len(table) - 1, ROOT, -1):
+            parent = parents[node]
+            if parent == NO_NODE:
+                continue
+            parent_totals = totals[parent]
+            if flags[node] & IS_DIR:
+                size, count = totals[node]
+                parent_totals[0] += size
+                parent_totals[1] += count
+            else:
+                parent_totals[0] += sizes[node]
+                parent_totals[1] += 1
+        self._totals_ready = True
+
+    def disk_usage(self, path):
+        """
+        Возвращает (байты, число файлов) поддерева по заранее посчитанным суммам — O(1).
+        """
+        self.wait_loaded()
+        node = self.lookup(path)
+        if node is None:
+            raise FileNotFoundError(f"File or directory '{path}' does not exist.")
+        return node.totals()
+
+    def set_permissions(self, full_path, mode, recursive=False):
+        """
+        Меняет права доступа в оверлее, не переписывая архив.
+        С recursive права меняются у всего поддерева за один обход таблицы узлов;
+        в архив всё поддерево попадёт одной перезаписью при commit().
+        """
+        self.wait_loaded()
+        node = self.lookup(full_path)
+        if node is None or node == self.root:
+            raise FileNotFoundError(f"File or directory '{full_path}' does not exist.")
+        if not recursive:
+            node.mode = mode
+            self.changed_modes[node.path()] = node
+        else:
+            table = self.nodes
+            for node_id, path in table.walk_paths(node.id, node.path()):
+                table.modes[node_id] = mode
+                self.changed_modes[path] = FsNode(table, node_id)
+        if node.is_dir:
+            self._invalidate_search_cache(node)
+
+    def _invalidate_search_cache(self, directory):
+        """
+        Сбрасывает кэш проходимости только для поддиректорий затронутого узла.
+        """
+        table = self.nodes
+        search_ok, flags = table.search_ok, table.flags
+        for node in table.walk(directory.id):
+            if flags[node] & IS_DIR:
+                search_ok[node] = -1
+
+    def _parent_dir(self, path):
+        """
+        Возвращает директорию, в которой создаётся путь path.
+        """
+        parts = split_path(path)
+        if not parts:
+            raise FileExistsError("'/' already exists.")
+        parent = self.lookup('/'.join(parts[:-1]))
+        if parent is None:
+            raise FileNotFoundError(f"Directory '/{'/'.join(parts[:-1])}' does not exist.")
+        if not parent.is_dir:
+            raise NotADirectoryError(f"'/{'/'.join(parts[:-1])}' is not a directory.")
+        return parent
+
+    def can_create(self, path):
+        """
+        Создание требует прохода к родителю и права на запись в нём (как и удаление).
+        """
+        parent = self._parent_dir(path)
+        return self.is_searchable(parent) and self.can_access(parent, "write")
+
+    def _new_member(self, path, is_dir, mode, size=0, like=None):
+        """
+        Заголовок новой записи журнала. Владелец берётся из like (перезаписываемый или копируемый узел)
+        или из текущего пользователя.
+        """
+        info = tarfile.TarInfo(path)
+        info.type = tarfile.DIRTYPE if is_dir else tarfile.REGTYPE
+        info.mode = mode
+        info.size = size
+        info.mtime = int(time.time())
+        if like is not None:
+            info.uid, info.gid, info.uname, info.gname = like.uid, like.gid, like.owner, like.group
+        else:
+            info.uid = self.uid or 0
+            info.gid = self.gid or 0
+            info.uname, info.gname = self._owner_names(info.uid, info.gid)
+        return info
+
+    def _owner_names(self, uid, gid):
+        """
+        Имена пользователя и группы, под которыми uid и gid уже встречаются в дереве.
+        Если их там нет, имена остаются пустыми, как у tar без базы пользователей.
+        root у ненулевого номера — подстановка для записей без имени, а не настоящее имя.
+        """
+        uname = gname = ""
+        for owner_uid, owner_gid, owner, group in self.nodes.owner_table:
+            if not uname and owner_uid == uid and (owner != "root" or not uid):
+                uname = owner
+            if not gname and owner_gid == gid and (group != "root" or not gid):
+                gname = group
+        return uname, gname
+
+    def _append(self, info, chunks=()):
+        """
+        Дописывает запись в журнал и сразу обновляет дерево: архив не перечитывается,
+        стоимость записи пропорциональна объёму записанных данных.
+        """
+        journal = self._journal if self._journal is not None else self._attach_journal()
+        header_offset, data_offset, end_offset = journal.append(info, chunks)
+        self._add_entry(info.name, info.mode, info.uid, info.gid, info.uname, info.gname, info.isdir(),
+                        header_offset, end_offset, data_offset if info.isreg() else -1, info.size,
+                        info.mtime, layer=self._journal_layer)
+        self.content_cache.invalidate(info.name)
+        self.changed_modes.pop(info.name, None)  # Права уже записаны в новый заголовок
+
+    def write_file(self, full_path, data, append=False):
+        """
+        Записывает data (bytes) в файл, создавая его или заменяя новой версией в журнале.
+        При append новая версия состоит из старого содержимого и data.
+        """
+        self.wait_loaded()
+        parent = self._parent_dir(full_path)
+        name = split_path(full_path)[-1]
+        node = parent.children.get(name)
+        if node is not None and (node.is_dir or node.offset is None):
+            raise IsADirectoryError(f"'{full_path}' is not a regular file.")
+        path = child_path(parent, name)
+        chunks = [data]
+        size = len(data)
+        if append and node is not None:
+            chunks = itertools.chain(self.iter_file(path), chunks)
+            size += node.size
+        mode = node.mode if node is not None else NEW_FILE_MODE
+        self._append(self._new_member(path, False, mode, size, like=node), chunks)
+
+    def make_dir(self, full_path):
+        self.wait_loaded()
+        parent = self._parent_dir(full_path)
+        name = split_path(full_path)[-1]
+        if name in parent.children:
+            raise FileExistsError(f"'{full_path}' already exists.")
+        self._append(self._new_member(child_path(parent, name), True, NEW_DIR_MODE))
+
+    def copy(self, source, destination):
+        """
+        Копирует файл или поддерево source в destination (новые записи журнала).
+        Возвращает узел новой копии.
+        """
+        self.wait_loaded()
+        node = self.lookup(source)
+        if node is None or node == self.root:
+            raise FileNotFoundError(f"File or directory '{source}' does not exist.")
+        parent = self._parent_dir(destination)
+        name = split_path(destination)[-1]
+        target = child_path(parent, name)
+        source_path = node.path()
+        if target == source_path or target.startswith(source_path + "/"):
+            raise ValueError(f"Cannot copy '{source}' into itself.")
+        existing = parent.children.get(name)
+        if existing is not None and existing.is_dir != node.is_dir:
+            raise IsADirectoryError(f"Cannot overwrite '{destination}' with '{source}'.")
+        # Список узлов снимается заранее: копирование добавляет узлы в дерево
+        for item in sorted(node.walk(), key=lambda item: item.path()):
+            path = target + item.path()[len(source_path):]
+            if item.is_dir:
+                if self._find(path) is None:
+                    self._append(self._new_member(path, True, item.mode, like=item))
+            elif item.offset is not None:
+                self._append(self._new_member(path, False, item.mode, item.size, like=item),
+                             self.iter_file(item.path()))
+        return self._find(target)
+
+    def move(self, source, destination):
+        """
+        Переносит файл или поддерево: копия под новым именем и whiteout-запись
+        для старого пути в журнале, так что перенос переживает перезапуск.
         """
-        # Построим полный путь
-        full_path = filename
-
-        if full_path not in self.metadata:
-            print(f"File '{full_path}' does not exist.")
-
-        file_metadata = self.metadata[full_path]
-        permissions = file_metadata["permissions"]
-
-        # print(permissions)
-
-        user_roles = {"user": 0, "group": 1, "other": 2}
-        role = user_roles.get(user, 2)  # Если роль не определена, считать "другие"
-        offsets = {"read": 0, "write": 1, "execute": 2}
-
-        if permissions[0] in '0123456789' and permissions[1] in '0123456789' and permissions[2] in '0123456789':
-            new_permissions = ""
-            for i in range(3):
-                if permissions[i] == '4':
-                    new_permissions += 'r--'
-                elif permissions[i] == '5':
-                    new_permissions += 'r-x'
-                elif permissions[i] == '6':
-                    new_permissions += 'rw-'
-                elif permissions[i] == '7':
-                    new_permissions += 'rwx'
-                elif permissions[i] == '1':
-                    new_permissions += '--x'
-                elif permissions[i] == '2':
-                    new_permissions += '-w-'
-                elif permissions[i] == '3':
-                    new_permissions += '-wx'
+        node = self.lookup(source)
+        if node is None or node == self.root:
+            raise FileNotFoundError(f"File or directory '{source}' does not exist.")
+        self.copy(source, destination)
+        self._append(self._new_member(child_path(node.parent, WHITEOUT_PREFIX + node.name),
+                                      False, NEW_FILE_MODE))
+        self._discard(node)
+
+    def pending_changes(self):
+        journaled = self._journal.count if self._journal is not None else 0
+        return len(self.whiteouts) + len(self.changed_modes) + journaled
+
+    def commit(self, output=None, compact=False):
+        """
+        Записывает накопленные в оверлее изменения и журнал в новый архив за один проход.
+        Неизменённые записи копируются из старых архивов сырыми диапазонами байт,
+        заголовки генерируются заново только для записей со сменой прав.
+        Перекрытые записи (старые версии файлов, удалённое) в новый архив не попадают,
+        поэтому с compact=True архив переписывается, даже если изменений нет.
+        Если смонтировано несколько слоёв, они сливаются в один архив output,
+        и дальше файловая система работает с ним. Возвращает количество применённых изменений.
+        """
+        self.wait_loaded()  # Иначе в новый архив попадут только уже проиндексированные записи
+        if output is None and len(self.base_layers) > 1:
+            raise ValueError("Several archives are mounted: commit needs an output path.")
+        applied = self.pending_changes()
+        if not applied and output is None and not compact:
+            return 0
+        target = output if output is not None else self.tar_path
+
+        # Живые записи в порядке слоёв и расположения в файлах: номера узлов, а не объекты,
+        # две устойчивые сортировки по целым ключам вместо кортежа на каждую запись
+        table = self.nodes
+        layers, header_offsets, end_offsets, offsets = \
+            table.layers, table.header_offsets, table.end_offsets, table.offsets
+        nodes = [node for node in table.walk(ROOT) if header_offsets[node] >= 0]
+        nodes.sort(key=header_offsets.__getitem__)
+        nodes.sort(key=layers.__getitem__)
+        changed = {node.id for node in self.changed_modes.values()}
+
+        temp_tar_path = target + ".tmp"
+        # Новые границы записей, по порядку записи в архив
+        written, new_headers, new_data, new_ends = array("i"), array("q"), array("q"), array("q")
+        # Новый архив пишется с тем же сжатием, что и базовый слой
+        with self._archives[0].create_writer(temp_tar_path) as new_tar:
+            position = 0
+            run_archive = run_start = run_end = None  # Текущий непрерывный диапазон для копирования
+            for node in nodes:
+                archive = self._archives[layers[node]]
+                header_offset, end_offset, offset = header_offsets[node], end_offsets[node], offsets[node]
+                written.append(node)
+                if node in changed:
+                    if run_start is not None:
+                        run_archive.copy_to(new_tar, run_start, run_end - run_start)
+                        run_start = None
+                    header = self._rebuild_header(FsNode(table, node))
+                    new_tar.write(header)
+                    data_start = offset if offset >= 0 else end_offset
+                    new_end = position + len(header) + end_offset - data_start
+                    new_headers.append(position)
+                    new_data.append(position + len(header))
+                    new_ends.append(new_end)
+                    archive.copy_to(new_tar, data_start, end_offset - data_start)
+                    position = new_end
+                    continue
+                if run_start is not None and run_archive is archive and run_end == header_offset:
+                    run_end = end_offset
                 else:
-                    new_permissions += '---'
+                    if run_start is not None:
+                        run_archive.copy_to(new_tar, run_start, run_end - run_start)
+                    run_archive, run_start, run_end = archive, header_offset, end_offset
+                new_end = position + end_offset - header_offset
+                new_headers.append(position)
+                new_data.append(position + (offset - header_offset if offset >= 0 else 0))
+                new_ends.append(new_end)
+                position = new_end
+            if run_start is not None:
+                run_archive.copy_to(new_tar, run_start, run_end - run_start)
+
+            # Директории, которых не было в архиве явно, но у которых сменились права
+            for node in self.changed_modes.values():
+                if node.header_offset is None and node.is_dir:
+                    info = tarfile.TarInfo(node.path())
+                    info.type = tarfile.DIRTYPE
+                    info.mode = node.mode
+                    info.mtime = node.mtime
+                    info.uid, info.gid = node.uid, node.gid
+                    info.uname, info.gname = node.owner, node.group
+                    header = info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+                    new_tar.write(header)
+                    written.append(node.id)
+                    new_headers.append(position)
+                    new_data.append(-1)
+                    new_ends.append(position + len(header))
+                    position += len(header)
+
+            # Конец архива: два нулевых блока, выравнивание на размер записи
+            end = position + 2 * tarfile.BLOCKSIZE
+            end += -end % tarfile.RECORDSIZE
+            new_tar.write(b"\0" * (end - position))
+
+        for archive in self._archives:
+            archive.close()
+        os.replace(temp_tar_path, target)
+        # Журнал влит в архив; журнал исходного архива остаётся, если результат записан в другой файл
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = self._journal_layer = None
+        if os.path.exists(journal_path(target)):
+            os.remove(journal_path(target))
+        self.layers = [target]
+        self.base_layers = [target]
+        self.tar_path = target
+        self._archives = [self._open_archive(target)]
+        self._layer_states = {0: self._layer_state(0, *self._stat_layer(0), position)}
+        table.next_generation()  # Смещения узлов теперь относятся к новому архиву
+        for index, node in enumerate(written):
+            layers[node] = 0
+            header_offsets[node] = new_headers[index]
+            if offsets[node] >= 0:
+                offsets[node] = new_data[index]
+            end_offsets[node] = new_ends[index]
+        self.whiteouts.clear()
+        self.changed_modes.clear()
+        if self.use_index_cache:
+            self._save_index_cache()
+        return applied
+
+    def _rebuild_header(self, node):
+        """
+        Перечитывает заголовок записи из архива и кодирует его заново с новыми правами.
+        """
+        self.tracer.count("archive_opens")
+        with self._archives[node.layer].open_stream() as stream, self.tracer.parsing("rebuild header"):
+            stream.seek(node.header_offset)
+            with tarfile.open(fileobj=stream, mode="r:") as tar:
+                member = tar.next()
+        member.mode = node.mode
+        return member.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+
+    def _load_metadata(self, progress=None, notify_every=1024):
+        """
+        Загружает метаданные всех слоёв по порядку и строит общее дерево.
+        Недостающие родительские директории создаются со стандартными правами.
+        Если передано условие progress, ожидающие потоки будят каждые notify_every записей.
+        """
+        for layer in range(len(self.layers)):
+            # Отпечаток снимается до разбора: то, что допишут во время разбора, заметит следующий refresh()
+            identity, stamp = self._stat_layer(layer)
+            end = self._load_layer(layer, stamp, progress, notify_every)
+            self._layer_states[layer] = self._layer_state(layer, identity, stamp, end)
+            if progress is not None:
+                with progress:
+                    progress.notify_all()
+        self._compute_totals()
+
+    def _load_layer(self, layer, stamp, progress=None, notify_every=1024):
+        """
+        Добавляет в дерево записи одного слоя: из его файла-индекса <слой>.idx или
+        разбором заголовков. Большие несжатые архивы разбираются параллельно несколькими
+        процессами (кроме ленивого режима). При последовательном разборе записи базового слоя
+        добавляются прямо по ходу разбора, у верхних слоёв сначала применяются
+        whiteout-записи, чтобы они удаляли только нижние слои. Вместе с .idx базового слоя
+        хранится снимок его дерева: тёплый старт восстанавливает колонки таблицы целиком.
+        stamp — отпечаток файла слоя, снятый до разбора: с ним сверяется и им помечается .idx.
+        Возвращает смещение конца последней записи слоя (начало завершающих нулевых блоков).
+        """
+        path = self.layers[layer]
+        # Журнал меняется при каждой записи, поэтому всегда разбирается заново (он небольшой)
+        use_index_cache = self.use_index_cache and layer != self._journal_layer
+        if use_index_cache:
+            with self.tracer.parsing("load index"):
+                loaded = read_index(path, stamp)
+                if loaded is not None:
+                    rows, tree = loaded
+                    if layer or tree is None or not self._restore_tree(tree):
+                        self._merge_rows(rows, layer)
+                        if not layer:  # Индекс без снимка (после refresh или commit): дополним его
+                            save_index(path, rows, stamp, self._layer_tree(layer))
+            if loaded is not None:
+                return max(rows.end_offsets, default=0)
+
+        archive = self._archives[layer]
+        if progress is None and archive.plain_path is not None and layer != self._journal_layer \
+                and can_parallelize(archive.plain_path, self.index_workers):
+            self.tracer.count("archive_opens")
+            with self.tracer.parsing("parallel index"):
+                rows = build_rows(archive.plain_path, self.index_workers)
+                if rows is not None:
+                    self._merge_rows(rows, layer)
+            if rows is not None:
+                self.tracer.count("headers_parsed", len(rows))
+                if use_index_cache:
+                    save_index(path, rows, stamp, self._layer_tree(layer))
+                return max(rows.end_offsets, default=0)
+
+        rows = IndexColumns() if use_index_cache or layer else None
+        self.tracer.count("archive_opens")
+        count = end = 0
+        with archive.open_stream() as stream, self.tracer.parsing(), \
+                tarfile.open(fileobj=stream, mode="r:") as tar:
+            for count, member in enumerate(tar, 1):
+                row = member_row(member, tar.offset)  # tarfile уже сдвинулся на конец записи
+                end = tar.offset
+                tar.members = []  # TarInfo не накапливаются: всё нужное уже в дереве
+                if rows is not None:
+                    rows.append(row)
+                if not layer:
+                    self._add_entry(*row)
+                if progress is not None and count % notify_every == 0:
+                    with progress:
+                        progress.notify_all()
+        self.tracer.count("headers_parsed", count)
+        if layer:
+            self._merge_rows(rows, layer)
+        if use_index_cache:
+            save_index(path, rows, stamp, self._layer_tree(layer))
+        return end
+
+    def _layer_tree(self, layer):
+        """
+        Снимок дерева для .idx слоя: только у базового слоя дерево построено из него одного.
+        """
+        return None if layer else self.nodes.dump()
+
+    def _restore_tree(self, tree):
+        """
+        Подменяет пустое дерево снимком базового слоя из .idx. False, если снимок повреждён.
+        """
+        try:
+            table = NodeTable.load(tree)
+        except (ValueError, TypeError, IndexError):
+            return False
+        self.nodes = table
+        self.root = FsNode(table, ROOT)
+        return True
+
+    def _merge_rows(self, rows, layer):
+        """
+        Накладывает слой на дерево: сначала удаления (whiteout), затем записи слоя.
+        Журнал воспроизводится строго по порядку: в нём удаление и новая запись
+        с тем же именем могут чередоваться (mv a b, затем запись в a).
+        rows — IndexColumns, его можно обойти дважды без копирования в список.
+        """
+        self.nodes.reserve(len(rows))
+        if layer == self._journal_layer:
+            for row in rows:
+                if os.path.basename(row[0].rstrip('/')).startswith(WHITEOUT_PREFIX):
+                    self._apply_whiteout(row[0])
+                self._add_entry(*row, layer=layer)
+            return
+        if layer:  # Под базовым слоем удалять нечего
+            for row in rows:
+                if os.path.basename(row[0].rstrip('/')).startswith(WHITEOUT_PREFIX):
+                    self._apply_whiteout(row[0])
+        for row in rows:
+            self._add_entry(*row, layer=layer)
+
+    def _apply_whiteout(self, path):
+        """
+        .wh.<имя> удаляет <имя> нижних слоёв, .wh..wh..opq скрывает всё содержимое директории.
+        """
+        parts = split_path(path)
+        directory = self._find('/'.join(parts[:-1]))
+        if directory is None or not directory.is_dir:
+            return
+        if parts[-1] == OPAQUE_WHITEOUT:
+            for child in directory.children.values():
+                self._detach(child)
+            return
+        node = directory.children.get(parts[-1][len(WHITEOUT_PREFIX):])
+        if node is not None:
+            self._detach(node)
+
+    def _directory_id(self, parts):
+        """
+        Номер директории по компонентам пути; недостающие директории создаются
+        со стандартными правами, файл на пути заменяется директорией.
+        Найденные директории запоминаются по пути: директорий намного меньше, чем файлов,
+        и повторный поиск по всему пути для каждой записи не нужен.
+        """
+        table = self.nodes
+        key = '/'.join(parts)
+        parent = self._directory_ids.get(key)
+        if parent is not None:
+            return parent
+        parent = ROOT
+        for part in parts:
+            name = part.encode(*NAME_ENCODING)
+            child = table.child(parent, name)
+            if child == NO_NODE or not table.flags[child] & IS_DIR:
+                if child != NO_NODE:  # Файл заменяется директорией
+                    self._detach(FsNode(table, child))
+                elif self._listings:
+                    self._children_changed(FsNode(table, parent))
+                child = table.add(parent, name, IS_DIR, 0o755, table.owner_id(0, 0, "root", "root"))
+            parent = child
+        self._directory_ids[key] = parent
+        return parent
+
+    def _add_entry(self, path, mode, uid, gid, owner, group, is_dir,
+                   header_offset, end_offset, offset, size, mtime=0, linkname="", layer=0):
+        """
+        Добавляет запись в дерево. Новый узел заполняется до того, как
+        становится виден в дереве, чтобы параллельные читатели не видели полупустых узлов.
+        offset равен -1 для записей без данных (директории, ссылки); у ссылок linkname — тип и цель.
+        Whiteout-записи в дерево не попадают.
+        """
+        parts = split_path(path)
+        if not parts or parts[-1].startswith(WHITEOUT_PREFIX):
+            return
+        table = self.nodes
+        parent = self._directory_id(parts[:-1])
+        name = parts[-1].encode(*NAME_ENCODING)
+        node = table.child(parent, name)
+        if node != NO_NODE and bool(table.flags[node] & IS_DIR) != is_dir:
+            self._detach(FsNode(table, node))  # Тип сменился: старое поддерево уходит целиком
+            node = NO_NODE
+        owner_id = table.owner_id(uid, gid, owner or "root", group or "root")
+        if node == NO_NODE:
+            if self._listings:  # Пока идёт загрузка, кэш пуст и проверка ничего не стоит
+                self._children_changed(FsNode(table, parent))
+            if linkname:
+                table.links[len(table)] = linkname
+            node = table.add(parent, name, IS_DIR if is_dir else 0, S_IMODE(mode), owner_id, layer,
+                             header_offset, end_offset, offset, size if offset >= 0 else 0, mtime)
+            if self._totals_ready:
+                self._adjust_totals(FsNode(table, parent), *FsNode(table, node).totals())
+            return
+        # Более поздняя запись (в архиве или в верхнем слое) перекрывает предыдущую;
+        # содержимое директорий при этом объединяется
+        before_size = table.sizes[node]
+        access_changed = table.modes[node] != S_IMODE(mode) or table.owners[node] != owner_id
+        table.modes[node] = S_IMODE(mode)
+        table.owners[node] = owner_id
+        if is_dir and access_changed and table.search_ok[node] != -1:
+            # Явный заголовок директории перекрыл права неявной (или более ранней) записи:
+            # проходимость, уже вычисленная для поддерева при фоновой загрузке, устарела.
+            # Кэш заполняется от корня вниз, так что без значения у самой директории сбрасывать нечего
+            self._invalidate_search_cache(FsNode(table, node))
+        if offset >= 0:
+            table.offsets[node] = offset
+            table.sizes[node] = size
+        elif not is_dir:
+            table.offsets[node] = -1  # Ссылка перекрыла обычный файл
+            table.sizes[node] = 0
+        table.mtimes[node] = mtime
+        if linkname:
+            table.links[node] = linkname
+        else:
+            table.links.pop(node, None)
+        table.layers[node] = layer
+        table.header_offsets[node] = header_offset
+        table.end_offsets[node] = end_offset
+        if self._totals_ready and not is_dir:
+            self._adjust_totals(FsNode(table, parent), table.sizes[node] - before_size, 0)
+
+    def _save_index_cache(self):
+        """
+        Сохраняет записи архива из дерева в файл-индекс (без изменений оверлея).
+        """
+        table = self.nodes
+        header_offsets = table.header_offsets
+        nodes = [node for node in table.walk(ROOT) if header_offsets[node] >= 0]
+        nodes.sort(key=header_offsets.__getitem__)
+        rows = IndexColumns()
+        for node in nodes:
+            view = FsNode(table, node)
+            rows.append((view.path(), view.mode, view.uid, view.gid, view.owner, view.group, view.is_dir,
+                         header_offsets[node], table.end_offsets[node], table.offsets[node],
+                         table.sizes[node], table.mtimes[node], table.links.get(node, "")))
+        save_index(self.tar_path, rows, self._layer_states[0].fingerprint)
+
+    def _stat_layer(self, layer):
+        """
+        (устройство и inode, отпечаток) файла слоя: по inode видна замена файла, по отпечатку — изменение.
+        """
+        path = self.layers[layer]
+        stat = os.stat(path)
+        return (stat.st_dev, stat.st_ino), fingerprint(path)
+
+    def _layer_state(self, layer, identity, stamp, end):
+        """
+        Запоминает слой после разбора. У несжатого архива сохраняются первый блок и последний
+        блок перед концом записей: дописывание в конец (tar -r) их не меняет.
+        """
+        archive = self._archives[layer]
+        boundary = None
+        if archive.compression is None:
+            boundary = archive.pread(0, tarfile.BLOCKSIZE) + \
+                archive.pread(max(end - tarfile.BLOCKSIZE, 0), tarfile.BLOCKSIZE)
+        return LayerState(identity, stamp, end, boundary)
+
+    def refresh(self):
+        """
+        Подхватывает изменения архивов на диске (опрос размера, времени изменения и inode, без inotify).
+        Если несжатый архив только дописан в конец, разбираются лишь заголовки после прежнего
+        конца записей, и новые записи вливаются в живой индекс; верхние слои и журнал
+        накладываются заново поверх них. Если изменилась уже прочитанная часть или файл заменён,
+        индекс перестраивается целиком. Несохранённые rm и chmod в обоих случаях сохраняются.
+        При общем доступе вызывается под self.lock.write().
+        Возвращает REFRESH_UNCHANGED, REFRESH_APPENDED или REFRESH_RELOADED.
+        """
+        self.wait_loaded()
+        appended = {}  # Слой -> (inode, отпечаток до разбора, новые строки, новый конец записей)
+        for layer in range(len(self.base_layers)):
+            state = self._layer_states[layer]
+            try:
+                identity, stamp = self._stat_layer(layer)
+            except OSError:
+                continue  # Архив как раз заменяют: проверим при следующем опросе
+            if identity == state.identity and stamp == state.fingerprint:
+                continue
+            if identity != state.identity or not self._prefix_unchanged(layer, state, stamp):
+                self._reload()
+                return REFRESH_RELOADED
+            try:
+                rows, end, pending = self._read_appended(layer, state.end)
+            except tarfile.TarError:
+                rows, end, pending = None, state.end, False
+            if not rows:
+                if pending:
+                    continue  # Запись дописывается прямо сейчас: дождёмся её целиком
+                # Файл изменился, но новых записей нет — значит, переписана уже прочитанная часть
+                self._reload()
+                return REFRESH_RELOADED
+            appended[layer] = identity, stamp, rows, end, pending
+        if not appended:
+            return REFRESH_UNCHANGED
+
+        overlay = self._overlay_snapshot()
+        lowest = min(appended)
+        identity, stamp, rows, end, pending = appended[lowest]
+        with self.tracer.parsing("refresh"):
+            self._merge_rows(rows, lowest)
+        if self.use_index_cache and not pending:
+            previous = load_index(self.layers[lowest], self._layer_states[lowest].fingerprint)
+            if previous is not None:
+                previous.extend(rows)
+                save_index(self.layers[lowest], previous, stamp)
+        self._layer_states[lowest] = self._layer_state(lowest, identity, stamp, end)
+        # Записи верхних слоёв должны остаться поверх дописанных: слои накладываются заново
+        # (из их .idx, журнал — разбором, он небольшой)
+        for layer in range(lowest + 1, len(self.layers)):
+            identity, stamp = self._stat_layer(layer)
+            end = self._load_layer(layer, stamp)
+            self._layer_states[layer] = self._layer_state(layer, identity, stamp, end)
+        self._apply_overlay(overlay)
+        self.content_cache.clear()
+        if any(rows.dirs):  # Права дописанных директорий могли изменить проходимость путей
+            self._invalidate_search_cache(self.root)
+        return REFRESH_APPENDED
+
+    def _prefix_unchanged(self, layer, state, stamp):
+        """
+        Дописан ли архив только в конец: файл не короче прежних записей, и граничные блоки те же.
+        """
+        if state.boundary is None or stamp[0] < state.end:
+            return False
+        archive = self._archives[layer]
+        current = archive.pread(0, tarfile.BLOCKSIZE) + \
+            archive.pread(max(state.end - tarfile.BLOCKSIZE, 0), tarfile.BLOCKSIZE)
+        return current == state.boundary
+
+    def _read_appended(self, layer, start):
+        """
+        Разбирает записи, начинающиеся с start (прежний конец записей слоя).
+        Возвращает (строки, новый конец записей, осталась ли недописанная запись).
+        """
+        rows = IndexColumns()
+        end = start
+        self.tracer.count("archive_opens")
+        with self._archives[layer].open_stream() as stream, self.tracer.parsing("refresh"):
+            size = os.fstat(stream.fileno()).st_size
+            stream.seek(start)
+            with tarfile.open(fileobj=stream, mode="r:") as tar:  # Смещения записей — от начала файла
+                for member in tar:
+                    if tar.offset > size:
+                        return rows, end, True
+                    rows.append(member_row(member, tar.offset))
+                    end = tar.offset
+                    tar.members = []
+        self.tracer.count("headers_parsed", len(rows))
+        return rows, end, False
+
+    def _reload(self):
+        """
+        Перестраивает индекс целиком, заново открыв архивы базовых слоев.
+        Новое дерево строится в стороне: если архив не читается (например, его как раз
+        переписывают), ошибка пробрасывается, а прежние индекс и архивы остаются рабочими.
+        """
+        overlay = self._overlay_snapshot()
+        previous = (self._archives, self.nodes, self.root, self._directory_ids,
+                    self._totals_ready, self._layer_states)
+        archives = list(self._archives)
+        try:
+            for layer, path in enumerate(self.base_layers):
+                archives[layer] = self._open_archive(path)
+            self._archives = archives
+            self.nodes = NodeTable()
+            self.root = FsNode(self.nodes, ROOT)
+            self._directory_ids = {}
+            self._totals_ready = False
+            self._layer_states = {}
+            self._load_metadata()
+        except BaseException:
+            for layer in range(len(self.base_layers)):
+                if archives[layer] is not previous[0][layer]:
+                    archives[layer].close()
+            (self._archives, self.nodes, self.root, self._directory_ids,
+             self._totals_ready, self._layer_states) = previous
+            raise
+        for layer in range(len(self.base_layers)):
+            previous[0][layer].close()
+        with self._listings_lock:
+            self._listings.clear()
+        self.content_cache.clear()
+        self._apply_overlay(overlay)
+
+    def _overlay_snapshot(self):
+        """
+        Несохранённые изменения по путям: их нужно применить снова после перечитывания слоёв.
+        """
+        return dict(self.whiteouts), {path: node.mode for path, node in self.changed_modes.items()}
+
+    def _apply_overlay(self, overlay):
+        whiteouts, modes = overlay
+        for path, position in whiteouts.items():
+            node = self._find_id(path)
+            if node not in (NO_NODE, ROOT):
+                self._remove_older(node, position)
+        self.changed_modes = {}
+        for path, mode in modes.items():
+            node = self._find(path)
+            if node is not None:
+                node.mode = mode
+                self.changed_modes[path] = node
+
+    def _remove_older(self, node, position):
+        """
+        Повторяет несохранённый rm после перечитывания слоёв: удаляет из поддерева всё, что было
+        в дереве до удаления, но оставляет записанное в журнал после него (смещение >= position)
+        и директории на пути к таким записям. Возвращает, осталось ли что-то от поддерева.
+        """
+        table = self.nodes
+        kept = False
+        for child in list(table.children(node)):
+            kept = self._remove_older(child, position) or kept
+        if kept or (table.layers[node] == self._journal_layer and table.header_offsets[node] >= position):
+            return True
+        self._detach(FsNode(table, node))
+        return False
+
+    def _load_in_background(self):
+        try:
+            self._load_metadata(progress=self._progress)
+        except Exception as error:
+            self._load_error = error
+        finally:
+            with self._progress:
+                self._loaded.set()
+                self._progress.notify_all()
+
+    def wait_loaded(self):
+        """
+        Блокирует до окончания построения индекса (в ленивом режиме).
+        """
+        self._loaded.wait()
+        if self._load_error is not None:
+            raise self._load_error
+
+    def is_loaded(self):
+        return self._loaded.is_set()
+
+    def waits_full_load(self):
+        """
+        Истина, если поиск узлов не может начаться до окончания загрузки: слоёв больше одного,
+        и запись нижнего слоя ещё может быть перекрыта или удалена (whiteout) верхним.
+        """
+        return len(self.layers) > 1
+
+    def access_role(self, node):
+        """
+        Определяет класс доступа текущего пользователя к узлу: 0 — владелец, 1 — группа, 2 — остальные.
+        Если uid не задан, пользователь считается владельцем всех файлов.
+        """
+        if self.uid is None or node.uid == self.uid:
+            return 0
+        if node.gid == self.gid:
+            return 1
+        return 2
+
+    def can_access(self, node, operation, role=None):
+        """
+        Проверка права одной битовой маской по заранее вычисленной таблице.
+        """
+        if role is None:
+            role = self.access_role(node)
+        return node.mode & ACCESS_MASKS[operation][role] != 0
 
-            permissions = new_permissions
+    def file_has_permission(self, filename, operation, user=None):
+        """
+        Проверяет, имеет ли пользователь право на операцию (read, write, execute).
+        user ("user", "group", "other") явно задаёт класс доступа вместо uid/gid.
+        """
+        file_node = self.lookup(filename)
+        if file_node is None:
+            raise FileNotFoundError(f"File '{filename}' does not exist.")
+        role = USER_ROLES.get(user, 2) if user is not None else None
+        return self.can_access(file_node, operation, role)
 
-        #(permissions)
-        # Позиция в строке rwxrwxrwx
-        pos = role * 3 + offsets[operation]
-        #print(pos)
-        #print(permissions[pos])
+    def is_searchable(self, directory):
+        """
+        Проверяет право на выполнение (x) для всех директорий от корня до directory включительно.
+        Результат кэшируется в узлах, поэтому повторные проверки стоят O(1).
+        """
+        uncached = []
+        node = directory
+        while node is not None and node.search_ok is None:
+            uncached.append(node)
+            node = node.parent
+        allowed = True if node is None else node.search_ok
+        for node in reversed(uncached):
+            allowed = allowed and self.can_access(node, "execute")
+            node.search_ok = allowed
+        return directory.search_ok
 
-        if permissions[pos] == "-":
+    def check_path_access(self, path, operation):
+        """
+        Проверяет операцию над путём с учётом прав всех директорий на пути к нему.
+        """
+        node = self.lookup(path)
+        if node is None:
+            raise FileNotFoundError(f"File '{path}' does not exist.")
+        if node.parent is not None and not self.is_searchable(node.parent):
             return False
+        if operation == "execute" and node.is_dir:
+            return self.is_searchable(node)
+        return self.can_access(node, operation)
 
-        # Дополнительно проверяем, что если это папка, права применимы корректно
-        if file_metadata["is_dir"] and operation in {"read", "write", "execute"}:
-            #print(permissions[pos] != "-")
-            return permissions[pos] != "-"
-
-        return permissions[pos] != "-"
-
-    # def file_has_permission(self, filename, operation, user="user"):
-    #     """
-    #     Проверяет, имеет ли пользователь право на операцию (read, write, execute).
-    #     """
-    #     # Построим полный путь
-    #     full_path = filename
-    #
-    #     print(self.metadata)
-    #     if full_path not in self.metadata:
-    #         raise FileNotFoundError(f"File '{full_path}' does not exist.")
-    #
-    #     file_metadata = self.metadata[full_path]
-    #     permissions = file_metadata["permissions"]
-    #
-    #     user_roles = {"user": 0, "group": 1, "other": 2}
-    #     role = user_roles.get(user, 2)  # Если роль не определена, считать "другие"
-    #     offsets = {"read": 0, "write": 1, "execute": 2}
-    #     #print(role)
-    #
-    #     new_permissions = ""
-    #     for i in range(3):
-    #         if permissions[i] == '4':
-    #             new_permissions += 'r--'
-    #         elif permissions[i] == '5':
-    #             new_permissions += 'r-e'
-    #         elif permissions[i] == '6':
-    #             new_permissions += 'rw-'
-    #         elif permissions[i] == '7':
-    #             new_permissions += 'rwe'
-    #         elif permissions[i] == '1':
-    #             new_permissions += '--e'
-    #         elif permissions[i] == '2':
-    #             new_permissions += '-w-'
-    #         elif permissions[i] == '3':
-    #             new_permissions += '-we'
-    #         else:
-    #             new_permissions += '---'
-    #
-    #     permissions = new_permissions
-    #     # Позиция в строке rwxrwxrwx
-    #     pos = role * 3 + offsets[operation]
-    #     #print(pos)
-    #     #print(permissions[pos])
-    #     return permissions[pos] != "-"
+    def can_remove(self, path):
+        """
+        Удаление требует прохода к родителю и прав на запись и выполнение в нём.
+        """
+        node = self.lookup(path)
+        if node is None or node.parent is None:
+            raise FileNotFoundError(f"File or directory '{path}' does not exist.")
+        return self.is_searchable(node.parent) and self.can_access(node.parent, "write")
+
+    def subtree_denied(self, node, operations, mode=None):
+        """
+        Возвращает первую непустую директорию поддерева node, в которой у пользователя нет
+        хотя бы одного из прав operations (для rm -r нужны чтение, запись и проход,
+        для chmod -R — чтение и проход), или None. Один проход по колонкам таблицы узлов
+        без представлений узлов и путей: права всего поддерева проверяются до изменений.
+        mode — права, которые директории получат до того, как в них заходят (chmod -R
+        меняет директорию раньше, чем читает её): проверяются они, а не текущие.
+        """
+        table = self.nodes
+        flags, modes, owners, first_child = table.flags, table.modes, table.owners, table.first_child
+        owner_table = table.owner_table
+        masks = [0, 0, 0]
+        for operation in operations:
+            for role, mask in enumerate(ACCESS_MASKS[operation]):
+                masks[role] |= mask
+        for node_id in table.walk(node.id):
+            if not flags[node_id] & IS_DIR or first_child[node_id] == NO_NODE:
+                continue
+            if self.uid is None:
+                role = 0
+            else:
+                uid, gid = owner_table[owners[node_id]][:2]
+                role = 0 if uid == self.uid else 1 if gid == self.gid else 2
+            current = modes[node_id] if mode is None else mode
+            if current & masks[role] != masks[role]:
+                return FsNode(table, node_id)
+        return None
+
+    def glob(self, pattern):
+        """
+        Раскрывает шаблон пути по индексу: компоненты без шаблона ищутся напрямую,
+        с шаблоном — только среди детей уже найденных директорий.
+        Возвращает отсортированные пути без ведущего '/'.
+        """
+        self.wait_loaded()
+        nodes = [self.root]
+        for part in split_path(pattern):
+            matched = []
+            if has_glob(part):
+                match = compile_glob(part)
+                show_hidden = part.startswith('.')
+                for node in nodes:
+                    if node.is_dir:
+                        matched.extend(child for name, child in node.children.items()
+                                       if match(name) and (show_hidden or not name.startswith('.')))
+            else:
+                for node in nodes:
+                    child = node.children.get(part) if node.is_dir else None
+                    if child is not None:
+                        matched.append(child)
+            nodes = matched
+            if not nodes:
+                break
+        return sorted(node.path() for node in nodes)
+
+    def find(self, path, pattern=None):
+        """
+        Обходит поддерево и отдаёт узлы, имя которых подходит под шаблон.
+        Недоступные для чтения или прохода директории не раскрываются.
+        """
+        self.wait_loaded()
+        start = self.lookup(path)
+        if start is None:
+            raise FileNotFoundError(f"File or directory '{path}' does not exist.")
+        match = compile_glob(pattern) if pattern is not None else None
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if match is None or match(node.name):
+                yield node
+            if node.is_dir and self.can_access(node, "read") and self.is_searchable(node):
+                stack.extend(node.children[name] for name in sorted(node.children, reverse=True))
+
+    def grep(self, pattern, path, workers=4):
+        """
+        Ищет регулярное выражение в содержимом файлов поддерева.
+        Файлы читаются в порядке их смещений в архивах, поэтому каждый слой проходится
+        последовательно один раз; поиск внутри файлов идёт в пуле потоков окнами
+        по workers * 2 файла. Окно дочитывается целиком до выдачи его строк: пока генератор
+        стоит (head, медленный клиент, сервер между порциями без блокировки), в фоне ничего
+        не читается, а при закрытии генератора непрочитанные файлы так и не читаются.
+        Отдаёт пары (путь, номер строки, строка).
+        """
+        search = re.compile(pattern.encode("utf-8")).search
+        files = [node for node in self.find(path)
+                 if node.offset is not None and self.can_access(node, "read")]
+        files.sort(key=lambda node: (node.layer, node.offset))
+
+        tracer = self.tracer
+
+        def scan(node):
+            read_before, bytes_before = tracer.thread_reads()
+            matches = []
+            pending = b""
+            number = 0
+            position = 0
+            while position < node.size:
+                chunk = self._read_at(node.offset + position, min(CHUNK_SIZE, node.size - position),
+                                      node.layer)
+                if not chunk:
+                    break
+                position += len(chunk)
+                lines = (pending + chunk).split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    number += 1
+                    if search(line):
+                        matches.append((number, line))
+            if pending and search(pending):
+                matches.append((number + 1, pending))
+            read_after, bytes_after = tracer.thread_reads()
+            return node.path(), matches, read_after - read_before, bytes_after - bytes_before
+
+        window = workers * 2
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = []
+            try:
+                for start in range(0, len(files), window):
+                    # Задачи окна ставятся по порядку, так что чтение идёт по возрастанию смещений
+                    futures = [pool.submit(scan, node) for node in files[start:start + window]]
+                    results = [future.result() for future in futures]
+                    for file_path, matches, read_seconds, read_bytes in results:
+                        tracer.add_thread_reads(read_seconds, read_bytes)  # Чтение засчитывается команде grep
+                        for number, line in matches:
+                            yield file_path, number, line.decode("utf-8", errors="replace")
+            finally:
+                for future in futures:  # После ошибки в одном файле остальные не дочитываются
+                    future.cancel()
+
+    # Библиотечный API: пути с ведущим '/' или без, права проверяются так же, как в оболочке,
+    # ошибки — подклассы OSError (FileNotFoundError, NotADirectoryError, IsADirectoryError,
+    # PermissionError). Для параллельного использования вместе с изменениями дерева вызовы
+    # оборачиваются в self.lock (как в server.py) или используется AsyncVirtualFileSystem.
+
+    def _existing(self, path):
+        """
+        Узел пути, до которого можно дойти (x на всех директориях выше него).
+        """
+        node = self.lookup(path)
+        if node is None:
+            raise FileNotFoundError(f"File or directory '{path}' does not exist.")
+        if node.parent is not None and not self.is_searchable(node.parent):
+            raise PermissionError(f"Permission denied: '{path}'.")
+        return node
+
+    def stat(self, path):
+        """
+        Сведения о файле или директории (FileStat) без чтения архива.
+        """
+        node = self._existing(path)
+        return FileStat('/' + node.path(), node.name, node.is_dir, not node.is_dir and node.offset is not None,
+                        node.mode, node.size, node.uid, node.gid, node.owner, node.group, node.mtime)
+
+    def listdir(self, path="/"):
+        """
+        Отсортированные имена содержимого директории; нужны права на чтение и проход.
+        """
+        self.wait_loaded()
+        node = self._existing(path)
+        if not node.is_dir:
+            raise NotADirectoryError(f"'{path}' is not a directory.")
+        if not (self.can_access(node, "read") and self.is_searchable(node)):
+            raise PermissionError(f"Permission denied: '{path}'.")
+        return list(self.sorted_children(node))
+
+    def open(self, path, mode="rb", encoding="utf-8", errors="strict"):
+        """
+        Открывает обычный файл на чтение: "rb" — двоичный буферизованный поток,
+        "r" — текстовый. Содержимое не читается целиком, данные берутся из архива по мере чтения.
+        """
+        if mode not in ("r", "rt", "rb"):
+            raise ValueError(f"Unsupported mode '{mode}': archive files are read-only.")
+        self._existing(path)
+        node = self._existing(self.resolve_link(path))
+        if node.is_dir:
+            raise IsADirectoryError(f"'{path}' is a directory.")
+        if node.offset is None:
+            raise OSError(f"'{path}' is not a regular file.")
+        if not self.can_access(node, "read"):
+            raise PermissionError(f"Permission denied: '{path}'.")
+        stream = io.BufferedReader(ArchiveFile(self, node), CHUNK_SIZE)
+        if mode == "rb":
+            return stream
+        return io.TextIOWrapper(stream, encoding=encoding, errors=errors)
+
+    def walk(self, top="/"):
+        """
+        Обходит поддерево сверху вниз, как os.walk: (директория, имена поддиректорий, имена файлов).
+        Список поддиректорий можно сократить на месте, чтобы не заходить в них.
+        Директории без прав на чтение и проход пропускаются.
+        """
+        self.wait_loaded()
+        start = self._existing(top)
+        if not start.is_dir:
+            raise NotADirectoryError(f"'{top}' is not a directory.")
+        stack = [start]
+        while stack:
+            directory = stack.pop()
+            if not (self.can_access(directory, "read") and self.is_searchable(directory)):
+                continue
+            children = directory.children
+            directories, files = [], []
+            for name in self.sorted_children(directory):
+                (directories if children[name].is_dir else files).append(name)
+            yield '/' + directory.path(), directories, files
+            stack.extend(node for node in (children.get(name) for name in reversed(directories))
+                         if node is not None and node.is_dir)
+
+    def remove(self, path, recursive=False):
+        """
+        Удаляет файл, а с recursive — директорию со всем содержимым (как rm -r).
+        Права всего поддерева проверяются до удаления; в архив изменение попадёт при commit().
+        """
+        self.wait_loaded()
+        node = self._existing(path)
+        if node == self.root:
+            raise PermissionError("The root directory cannot be removed.")
+        if not self.can_remove(path):
+            raise PermissionError(f"Permission denied: '{path}'.")
+        if node.is_dir:
+            if not recursive:
+                raise IsADirectoryError(f"'{path}' is a directory (use recursive=True).")
+            blocked = self.subtree_denied(node, ("read", "write", "execute"))
+            if blocked is not None:
+                raise PermissionError(f"Permission denied: '/{blocked.path()}'.")
+        self.remove_file(path)
 
     def list_files(self):
-        with tarfile.open(self.tar_path, 'r') as tar:
-            return tar.getnames()
+        """
+        Возвращает пути всех элементов дерева (без повторного чтения архива).
+        """
+        self.wait_loaded()
+        return [node.path() for node in self.root.walk() if node != self.root]
 
     def open_file(self, filename):
-        with tarfile.open(self.tar_path, 'r') as tar:
-            try:
-                file = tar.extractfile(filename)
-                return file.read().decode('utf-16') if file else f"File not found: {filename}"
-            except KeyError:
-                return f"File not found: {filename}"
+        try:
+            return self.read_file(filename).decode('utf-8')
+        except (FileNotFoundError, IsADirectoryError):
+            return f"File not found: {filename}"
 
     def chmod_file(self, filename, permissions):
         # Обновление прав доступа для файла
-        with tarfile.open(self.tar_path, 'r') as tar:
-            try:
-                file_info = tar.getmember(filename)
-                file_info.mode = int(permissions, 8)
-                return f"Permissions for '{filename}' updated to {permissions}"
-            except KeyError:
-                return f"File not found: {filename}"
-
-    # def remove_file(self, filename):
-    #     # Удаление файла из архива
-    #     with tarfile.open(self.tar_path, 'r') as tar:
-    #         try:
-    #             members = tar.getmembers()
-    #             updated_members = [m for m in members if m.name != filename]
-    #
-    #             # Создание нового архива
-    #             with tarfile.open(self.tar_path, 'w') as new_tar:
-    #                 for member in updated_members:
-    #                     new_tar.addfile(member, tar.extractfile(member.name))
-    #             return f"File '{filename}' removed."
-    #         except KeyError:
-    #             return f"File not found: {filename}"
+        try:
+            self.set_permissions(filename, parse_mode(permissions))
+        except ValueError:
+            return f"Invalid mode: {permissions}"
+        except FileNotFoundError:
+            return f"File not found: {filename}"
+        return f"Permissions for '{filename}' updated to {permissions}"
@@ -0,0 +1,175 @@
+import marshal
+import os
+import hashlib
+from array import array
+
+INDEX_VERSION = 7
+INDEX_SUFFIX = ".idx"
+PATH_ENCODING = ("utf-8", "surrogateescape")
+# Числовые колонки строки индекса и коды array для них
+NUMERIC_COLUMNS = (("modes", "I"), ("dirs", "B"), ("header_offsets", "q"), ("end_offsets", "q"),
+                   ("offsets", "q"), ("sizes", "q"), ("mtimes", "q"))
+
+
+def index_path(tar_path):
+    return tar_path + INDEX_SUFFIX
+
+
+class IndexColumns:
+    """
+    Строки индекса в колоночном виде: пути подряд в одном bytearray, числа в массивах array,
+    владельцы (uid, gid, имена) — номера в таблице интернированных значений.
+    Строка (path, mode, uid, gid, owner, group, is_dir, header_offset, end_offset, offset, size, mtime,
+    linkname) собирается только при обходе, поэтому миллионы строк не превращаются в миллионы кортежей.
+    offset равен -1 для записей без данных. Ссылок в архивах мало, поэтому их цели хранятся
+    в словаре links (номер строки -> цель), у остальных строк linkname пустой.
+    """
+    def __init__(self):
+        self.paths = bytearray()
+        self.path_ends = array("Q")
+        self.owners = array("I")
+        self.owner_table = []
+        self._owner_ids = {}
+        self.links = {}
+        for name, code in NUMERIC_COLUMNS:
+            setattr(self, name, array(code))
+
+    def __len__(self):
+        return len(self.path_ends)
+
+    def owner_id(self, key):
+        index = self._owner_ids.get(key)
+        if index is None:
+            index = self._owner_ids[key] = len(self.owner_table)
+            self.owner_table.append(key)
+        return index
+
+    def append(self, row):
+        path, mode, uid, gid, owner, group, is_dir, header_offset, end_offset, offset, size, mtime, linkname = row
+        if linkname:
+            self.links[len(self)] = linkname
+        self.paths += path.encode(*PATH_ENCODING)
+        self.path_ends.append(len(self.paths))
+        self.owners.append(self.owner_id((uid, gid, owner, group)))
+        self.modes.append(mode)
+        self.dirs.append(is_dir)
+        self.header_offsets.append(header_offset)
+        self.end_offsets.append(end_offset)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+
+    def extend(self, other, start=0):
+        """
+        Добавляет строки other начиная с номера start (срезами массивов, без сборки кортежей).
+        """
+        base = len(self.paths)
+        shift = len(self) - start
+        self.links.update((index + shift, linkname) for index, linkname in other.links.items() if index >= start)
+        path_start = other.path_ends[start - 1] if start else 0
+        self.paths += other.paths[path_start:]
+        self.path_ends.extend(end - path_start + base for end in other.path_ends[start:])
+        owner_ids = [self.owner_id(owner) for owner in other.owner_table]
+        self.owners.extend(owner_ids[owner] for owner in other.owners[start:])
+        for name, _ in NUMERIC_COLUMNS:
+            getattr(self, name).extend(getattr(other, name)[start:])
+
+    def rows(self, start=0):
+        paths, ends, owners, table, links = self.paths, self.path_ends, self.owners, self.owner_table, self.links
+        for index in range(start, len(ends)):
+            uid, gid, owner, group = table[owners[index]]
+            yield (paths[ends[index - 1] if index else 0:ends[index]].decode(*PATH_ENCODING),
+                   self.modes[index], uid, gid, owner, group, bool(self.dirs[index]),
+                   self.header_offsets[index], self.end_offsets[index], self.offsets[index],
+                   self.sizes[index], self.mtimes[index], links.get(index, ""))
+
+    __iter__ = rows
+
+    def dump(self):
+        """
+        Представление для marshal: байты массивов и таблица владельцев.
+        """
+        return (bytes(self.paths), self.path_ends.tobytes(), self.owners.tobytes(), self.owner_table,
+                [getattr(self, name).tobytes() for name, _ in NUMERIC_COLUMNS], self.links)
+
+    @classmethod
+    def load(cls, data):
+        columns = cls()
+        paths, path_ends, owners, owner_table, numeric, links = data
+        columns.paths = bytearray(paths)
+        columns.path_ends.frombytes(path_ends)
+        columns.owners.frombytes(owners)
+        columns.owner_table = [tuple(owner) for owner in owner_table]
+        columns._owner_ids = {owner: index for index, owner in enumerate(columns.owner_table)}
+        columns.links = dict(links)
+        for (name, _), raw in zip(NUMERIC_COLUMNS, numeric):
+            getattr(columns, name).frombytes(raw)
+        if any(len(getattr(columns, name)) != len(columns) for name, _ in NUMERIC_COLUMNS) \
+                or len(columns.owners) != len(columns):
+            raise ValueError("Inconsistent index columns")
+        return columns
+
+
+def fingerprint(tar_path):
+    """
+    Отпечаток архива для проверки актуальности индекса: размер, mtime
+    и хеш первого и последнего блоков (без чтения всего файла).
+    """
+    stat = os.stat(tar_path)
+    digest = hashlib.sha1()
+    with open(tar_path, "rb") as archive:
+        digest.update(archive.read(512))
+        if stat.st_size > 512:
+            archive.seek(max(stat.st_size - 512, 512))
+            digest.update(archive.read(512))
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+def read_index(tar_path, expected=None):
+    """
+    Загружает из файла <архив>.idx одним чтением строки индекса (IndexColumns)
+    и снимок дерева слоя (NodeTable.dump() или None). Возвращает (строки, снимок)
+    или None, если индекса нет, он повреждён или не соответствует архиву.
+    expected — отпечаток, с которым должен совпасть индекс, если архив с тех пор
+    мог измениться (например, был дописан); по умолчанию — отпечаток архива сейчас.
+    """
+    try:
+        with open(index_path(tar_path), "rb") as index_file:
+            data = marshal.loads(index_file.read())  # Одно последовательное чтение
+        version, stored, columns, tree = data
+        if expected is None:
+            expected = fingerprint(tar_path)
+        if version != INDEX_VERSION or tuple(stored) != tuple(expected):
+            return None
+        return IndexColumns.load(columns), tree
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def load_index(tar_path, expected=None):
+    """
+    Только строки индекса из <архив>.idx (см. read_index) или None.
+    """
+    loaded = read_index(tar_path, expected)
+    return None if loaded is None else loaded[0]
+
+
+def save_index(tar_path, rows, stamp, tree=None):
+    """
+    Сохраняет строки индекса (IndexColumns) в <архив>.idx: массивы пишутся как есть, байтами.
+    tree — снимок дерева, построенного из одного этого слоя (NodeTable.dump()): с ним тёплый старт
+    восстанавливает колонки дерева целиком, не добавляя пути заново.
+    stamp — отпечаток архива, снятый до разбора: если архив дописали во время разбора,
+    индекс не совпадёт с ним и будет перестроен, а не выдан за полный.
+    Ошибки записи (например, каталог только для чтения) не считаются фатальными.
+    """
+    temp_path = index_path(tar_path) + ".tmp"
+    try:
+        with open(temp_path, "wb") as index_file:
+            marshal.dump((INDEX_VERSION, stamp, rows.dump(), tree), index_file)
+        os.replace(temp_path, index_path(tar_path))
+    except OSError:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+MAX_TRACE_EVENTS = 100000  # Ограничение журнала событий, чтобы трассировка не съедала память
+EXPORT_FORMATS = ("json", "chrome")
+
+
+class Tracer:
+    """
+    Счётчики и таймеры для разбора задержек: время команд, число открытий архива,
+    прочитанные байты и время разбора заголовков. Время чтения и разбора
+    накапливается по потокам, поэтому каждой команде достаётся только её собственный ввод-вывод,
+    даже когда сервер выполняет несколько сессий параллельно.
+    Подробный журнал событий (для экспорта в Chrome trace) пишется только при tracing = True.
+    """
+    def __init__(self, tracing=False, max_events=MAX_TRACE_EVENTS):
+        self.tracing = tracing
+        self.events = deque(maxlen=max_events)
+        self.counters = {"archive_opens": 0, "reads": 0, "bytes_read": 0,
+                         "read_seconds": 0.0, "parse_seconds": 0.0, "headers_parsed": 0}
+        self.commands = {}  # Имя команды -> [количество, общее время, чтение, разбор, максимум]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def _thread_totals(self):
+        local = self._local
+        if not hasattr(local, "read_seconds"):
+            local.read_seconds = local.parse_seconds = 0.0
+            local.bytes_read = 0
+        return local
+
+    def _event(self, name, category, started, seconds, args=None):
+        self.events.append({"name": name, "cat": category, "ph": "X", "pid": os.getpid(),
+                            "tid": threading.get_ident(),
+                            "ts": (started - self._origin) * 1e6, "dur": seconds * 1e6,
+                            "args": args or {}})
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def record_read(self, started, size):
+        """
+        Учитывает одно чтение из архива, начатое в момент started (time.perf_counter()).
+        """
+        seconds = time.perf_counter() - started
+        local = self._thread_totals()
+        local.read_seconds += seconds
+        local.bytes_read += size
+        with self._lock:
+            self.counters["reads"] += 1
+            self.counters["bytes_read"] += size
+            self.counters["read_seconds"] += seconds
+        if self.tracing:
+            self._event("read", "io", started, seconds, {"bytes": size})
+
+    @contextmanager
+    def parsing(self, name="parse headers"):
+        """
+        Засекает разбор заголовков tar; число заголовков добавляется через count("headers_parsed").
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self._thread_totals().parse_seconds += seconds
+            with self._lock:
+                self.counters["parse_seconds"] += seconds
+            if self.tracing:
+                self._event(name, "parse", started, seconds)
+
+    def thread_reads(self):
+        """
+        Время и объём чтений текущего потока — для переноса в поток команды из пула (grep).
+        """
+        local = self._thread_totals()
+        return local.read_seconds, local.bytes_read
+
+    def add_thread_reads(self, seconds, size):
+        local = self._thread_totals()
+        local.read_seconds += seconds
+        local.bytes_read += size
+
+    def begin_command(self):
+        local = self._thread_totals()
+        return time.perf_counter(), local.read_seconds, local.parse_seconds, local.bytes_read
+
+    def end_command(self, name, token, command=None):
+        """
+        Закрывает замер команды, начатый begin_command(): общее время делится на
+        чтение архива, разбор заголовков и остальное (накладные расходы Python).
+        """
+        started, read_before, parse_before, bytes_before = token
+        seconds = time.perf_counter() - started
+        local = self._thread_totals()
+        read = local.read_seconds - read_before
+        parse = local.parse_seconds - parse_before
+        with self._lock:
+            stats = self.commands.setdefault(name, [0, 0.0, 0.0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += read
+            stats[3] += parse
+            stats[4] = max(stats[4], seconds)
+        if self.tracing:
+            self._event(name, "command", started, seconds,
+                        {"command": command, "read_ms": read * 1000, "parse_ms": parse * 1000,
+                         "bytes": local.bytes_read - bytes_before})
+
+    def reset(self):
+        with self._lock:
+            for key in self.counters:
+                self.counters[key] = 0
+            self.commands.clear()
+            self.events.clear()
+
+    def summary(self):
+        """
+        Снимок счётчиков и таймеров команд в виде словаря (для JSON).
+        """
+        with self._lock:
+            commands = {name: {"count": count, "total_seconds": total, "read_seconds": read,
+                               "parse_seconds": parse, "other_seconds": max(total - read - parse, 0.0),
+                               "max_seconds": longest}
+                        for name, (count, total, read, parse, longest) in self.commands.items()}
+            return {"counters": dict(self.counters), "commands": commands}
+
+    def chrome_trace(self):
+        """
+        Журнал событий в формате Chrome trace (chrome://tracing, Perfetto).
+        """
+        return {"traceEvents": list(self.events), "displayTimeUnit": "ms",
+                "otherData": self.summary()["counters"]}
+
+    def export(self, path, fmt="json"):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        data = self.chrome_trace() if fmt == "chrome" else self.summary()
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump(data, output, indent=None if fmt == "chrome" else 2)
+
+    def format_report(self):
+        """
+        Текстовая таблица: время команд с разбивкой на чтение, разбор и остальное.
+        """
+        summary = self.summary()
+        counters = summary["counters"]
+        lines = [f"Archive opens: {counters['archive_opens']}  Reads: {counters['reads']}  "
+                 f"Bytes read: {counters['bytes_read']}  Headers parsed: {counters['headers_parsed']}",
+                 f"{'command':<10}{'count':>8}{'total ms':>12}{'read ms':>12}{'parse ms':>12}"
+                 f"{'other ms':>12}{'max ms':>12}"]
+        for name, stats in sorted(summary["commands"].items()):
+            lines.append(f"{name:<10}{stats['count']:>8}{stats['total_seconds'] * 1000:>12.3f}"
+                         f"{stats['read_seconds'] * 1000:>12.3f}{stats['parse_seconds'] * 1000:>12.3f}"
+                         f"{stats['other_seconds'] * 1000:>12.3f}{stats['max_seconds'] * 1000:>12.3f}")
+        return "\n".join(lines)
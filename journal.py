@@ -0,0 +1,80 @@
+import os
+import tarfile
+
+JOURNAL_SUFFIX = ".journal"
+END_OF_ARCHIVE = b"\0" * (2 * tarfile.BLOCKSIZE)
+
+
+def journal_path(tar_path):
+    return tar_path + JOURNAL_SUFFIX
+
+
+class Journal:
+    """
+    Журнал изменений: отдельный несжатый tar рядом с архивом, в конец которого
+    дописываются новые записи (новые файлы, новые версии файлов, whiteout-записи).
+    Запись стоит O(размера данных): новый член пишется на место завершающих нулевых
+    блоков, после него снова пишутся два нулевых блока, так что журнал всегда остаётся корректным tar.
+    """
+    def __init__(self, path):
+        self.path = path
+        exists = os.path.exists(path)
+        self._file = open(path, "r+b" if exists else "w+b", buffering=0)
+        self.end = 0  # Смещение, с которого пишется следующая запись
+        self.count = 0
+        if exists:
+            self._recover()
+        else:
+            self._file.write(END_OF_ARCHIVE)
+
+    def _recover(self):
+        """
+        Находит конец последней целой записи; недописанный хвост (например, после сбоя) отбрасывается.
+        """
+        size = os.fstat(self._file.fileno()).st_size
+        try:
+            with tarfile.open(self.path, "r:") as tar:
+                for member in tar:
+                    if tar.offset > size:
+                        break
+                    self.end = tar.offset
+                    self.count += 1
+                    tar.members = []
+        except tarfile.ReadError:
+            pass  # Пустой или повреждённый с самого начала журнал
+        if size != self.end + len(END_OF_ARCHIVE):
+            self._file.truncate(self.end)
+            self._file.seek(self.end)
+            self._file.write(END_OF_ARCHIVE)
+
+    def append(self, info, chunks=()):
+        """
+        Дописывает запись info с данными из итератора chunks (размер должен совпадать с info.size).
+        Возвращает (смещение заголовка, смещение данных, конец записи).
+        """
+        header = info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape")
+        header_offset = self.end
+        self._file.seek(header_offset)
+        self._file.write(header)
+        data_offset = header_offset + len(header)
+        written = 0
+        for chunk in chunks:
+            self._file.write(chunk)
+            written += len(chunk)
+        if written != info.size:
+            self._file.truncate(header_offset)
+            self._file.seek(header_offset)
+            self._file.write(END_OF_ARCHIVE)
+            raise IOError(f"Expected {info.size} bytes for '{info.name}', got {written}.")
+        padding = -written % tarfile.BLOCKSIZE
+        self._file.write(b"\0" * padding + END_OF_ARCHIVE)
+        self.end = data_offset + written + padding
+        self.count += 1
+        return header_offset, data_offset, self.end
+
+    def close(self):
+        self._file.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
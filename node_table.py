@@ -0,0 +1,495 @@
+import itertools
+from array import array
+from collections.abc import Mapping
+from zlib import crc32
+
+NO_NODE = -1
+ROOT = 0
+DELETED = -2  # Освобождённая ячейка хеш-таблицы: поиск идёт дальше, вставка её не занимает
+IS_DIR = 1
+MIN_SLOTS = 1 << 10
+NAME_ENCODING = ("utf-8", "surrogateescape")  # Как tarfile декодирует имена
+_generations = itertools.count(1)
+# Первый символ записи в links — флаг типа из заголовка tar (LNKTYPE, SYMTYPE), дальше цель как в архиве
+HARD_LINK = "1"
+SYMBOLIC_LINK = "2"
+# Колонки, которые dump() сохраняет байтами как есть
+STORED_COLUMNS = ("parents", "first_child", "next_sibling", "prev_sibling", "name_ends", "flags", "modes",
+                  "owners", "layers", "header_offsets", "end_offsets", "offsets", "sizes", "mtimes")
+
+
+class NodeTable:
+    """
+    Колоночное хранилище дерева файловой системы. Узел — это номер строки, все поля лежат
+    в массивах array, имена компонент — подряд в одном bytearray, владельцы (uid, gid, имена)
+    интернированы в таблицу. Дети директории связаны в двусвязный список через соседей,
+    а поиск ребёнка по имени идёт по открытой хеш-таблице (родитель, имя) -> узел.
+    Хеш — crc32 имени с номером родителя в качестве начального значения: в отличие от hash()
+    он не меняется между запусками, поэтому хеш-таблица сохраняется в .idx вместе с колонками.
+    Так на запись архива тратится около сотни байт вместо нескольких Python-объектов.
+    Номер ребёнка всегда больше номера родителя: родитель создаётся раньше.
+    generation — номер поколения смещений: у каждой таблицы свой, и он меняется, когда
+    смещения узлов начинают относиться к другому архиву (commit). Открытые файлы и потоки
+    по нему замечают, что прочитанный ими узел мог устареть.
+    """
+    def __init__(self):
+        self.generation = next(_generations)
+        self.parents = array("i")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.prev_sibling = array("i")
+        self.names = bytearray()
+        self.name_ends = array("Q")
+        self.flags = array("B")
+        self.modes = array("H")
+        self.owners = array("I")  # Номер в owner_table
+        self.layers = array("H")  # Слой, из которого взяты заголовок и данные
+        self.header_offsets = array("q")  # -1: записи нет в архиве явно
+        self.end_offsets = array("q")
+        self.offsets = array("q")  # -1: у записи нет данных (директория, ссылка)
+        self.sizes = array("q")
+        self.mtimes = array("q")  # Время изменения из заголовка
+        self.search_ok = array("b")  # -1: не вычислено
+        self.totals = {}  # Директория -> [байты, файлы] поддерева
+        self.links = {}  # Ссылка -> тип и цель (см. HARD_LINK, SYMBOLIC_LINK)
+        self.owner_table = []  # (uid, gid, owner, group)
+        self._owner_ids = {}
+        self._slots = array("i", [NO_NODE]) * MIN_SLOTS
+        self._filled = 0  # Занятые ячейки, включая DELETED
+        self.add(NO_NODE, b"", IS_DIR, 0o755, self.owner_id(0, 0, "root", "root"))
+
+    def __len__(self):
+        return len(self.parents)
+
+    def next_generation(self):
+        self.generation = next(_generations)
+
+    def attached(self, node):
+        """
+        Достижим ли узел из корня (не отцеплен вместе с одним из предков).
+        """
+        parents = self.parents
+        while node != ROOT:
+            node = parents[node]
+            if node == NO_NODE:
+                return False
+        return True
+
+    def dump(self):
+        """
+        Представление для marshal: байты колонок и хеш-таблицы, имена, таблица владельцев
+        и цели ссылок. Суммы поддеревьев и кэш проходимости не сохраняются.
+        """
+        return ([getattr(self, name).tobytes() for name in STORED_COLUMNS], bytes(self.names),
+                self._slots.tobytes(), self._filled, self.owner_table, self.links)
+
+    @classmethod
+    def load(cls, data):
+        """
+        Таблица из представления dump(): колонки и хеш-таблица восстанавливаются через frombytes,
+        пути заново не разбираются и не хешируются. Несогласованные данные — ValueError.
+        """
+        table = cls()
+        columns, names, slots, filled, owner_table, links = data
+        if len(columns) != len(STORED_COLUMNS):
+            raise ValueError("Inconsistent node table")
+        for name, raw in zip(STORED_COLUMNS, columns):
+            column = array(getattr(table, name).typecode)
+            column.frombytes(raw)
+            setattr(table, name, column)
+        count = len(table.parents)
+        table._slots = array("i")
+        table._slots.frombytes(slots)
+        size = len(table._slots)
+        if not count or any(len(getattr(table, name)) != count for name in STORED_COLUMNS) \
+                or table.name_ends[-1] != len(names) or size < MIN_SLOTS or size & (size - 1) \
+                or not 0 <= filled < size:
+            raise ValueError("Inconsistent node table")
+        table._filled = filled
+        table.names = bytearray(names)
+        table.search_ok = array("b", [-1]) * count
+        table.owner_table = [tuple(owner) for owner in owner_table]
+        table._owner_ids = {owner: index for index, owner in enumerate(table.owner_table)}
+        table.links = dict(links)
+        flags = table.flags
+        table.totals = {node: [0, 0] for node in range(count) if flags[node] & IS_DIR}
+        return table
+
+    def owner_id(self, uid, gid, owner, group):
+        key = (uid, gid, owner, group)
+        index = self._owner_ids.get(key)
+        if index is None:
+            index = self._owner_ids[key] = len(self.owner_table)
+            self.owner_table.append(key)
+        return index
+
+    def name_bytes(self, node):
+        return bytes(self.names[self.name_ends[node - 1] if node else 0:self.name_ends[node]])
+
+    def name(self, node):
+        return self.name_bytes(node).decode(*NAME_ENCODING)
+
+    def _probe(self, parent, name):
+        """
+        Возвращает (ячейка, узел): ячейку с узлом (parent, name) или первую пустую.
+        """
+        slots = self._slots
+        mask = len(slots) - 1
+        index = crc32(name, parent) & mask
+        while True:
+            node = slots[index]
+            if node == NO_NODE:
+                return index, NO_NODE
+            if node >= 0 and self.parents[node] == parent and self.name_bytes(node) == name:
+                return index, node
+            index = (index + 1) & mask
+
+    def child(self, parent, name):
+        """
+        Номер ребёнка parent с именем name (str или bytes) или NO_NODE.
+        """
+        if isinstance(name, str):
+            name = name.encode(*NAME_ENCODING)
+        return self._probe(parent, name)[1]
+
+    def add(self, parent, name, flags, mode, owner, layer=0, header_offset=-1, end_offset=-1,
+            offset=-1, size=0, mtime=0):
+        """
+        Добавляет узел с именем name (bytes) в директорию parent. Имя не должно быть занято.
+        """
+        node = len(self.parents)
+        self.names += name
+        self.name_ends.append(len(self.names))
+        self.parents.append(parent)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.prev_sibling.append(NO_NODE)
+        self.flags.append(flags)
+        self.modes.append(mode)
+        self.owners.append(owner)
+        self.layers.append(layer)
+        self.header_offsets.append(header_offset)
+        self.end_offsets.append(end_offset)
+        self.offsets.append(offset)
+        self.sizes.append(size)
+        self.mtimes.append(mtime)
+        self.search_ok.append(-1)
+        if flags & IS_DIR:
+            self.totals[node] = [0, 0]
+        if parent != NO_NODE:
+            head = self.first_child[parent]
+            self.next_sibling[node] = head
+            if head != NO_NODE:
+                self.prev_sibling[head] = node
+            self.first_child[parent] = node
+            self._insert(node, parent, name)
+        return node
+
+    def _insert(self, node, parent, name):
+        if (self._filled + 1) * 2 > len(self._slots):
+            self._resize()
+        index, _ = self._probe(parent, name)
+        self._slots[index] = node
+        self._filled += 1
+
+    def reserve(self, count):
+        """
+        Заранее расширяет хеш-таблицу под count новых узлов, чтобы при загрузке
+        большого слоя она не перестраивалась многократно.
+        """
+        if (self._filled + count) * 2 > len(self._slots):
+            self._resize(count)
+
+    def _resize(self, extra=0):
+        """
+        Перестраивает хеш-таблицу по живым узлам (с запасом вдвое), выбрасывая DELETED.
+        """
+        live = sum(1 for node in self._slots if node >= 0)
+        size = MIN_SLOTS
+        while size < (live + extra) * 4:
+            size *= 2
+        # Новая таблица заполняется целиком до подмены: читатели из других потоков
+        # видят либо старую, либо готовую новую
+        slots = array("i", [NO_NODE]) * size
+        mask = size - 1
+        for node in self._slots:
+            if node >= 0:
+                index = crc32(self.name_bytes(node), self.parents[node]) & mask
+                while slots[index] != NO_NODE:
+                    index = (index + 1) & mask
+                slots[index] = node
+        self._slots = slots
+        self._filled = live
+
+    def detach(self, node):
+        """
+        Отцепляет узел (вместе с поддеревом) от родителя. Строки остаются в таблице,
+        но из корня к ним уже не дойти.
+        """
+        parent = self.parents[node]
+        if parent == NO_NODE:
+            return
+        index, _ = self._probe(parent, self.name_bytes(node))
+        self._slots[index] = DELETED
+        previous, following = self.prev_sibling[node], self.next_sibling[node]
+        if previous != NO_NODE:
+            self.next_sibling[previous] = following
+        else:
+            self.first_child[parent] = following
+        if following != NO_NODE:
+            self.prev_sibling[following] = previous
+        self.parents[node] = NO_NODE
+        self.next_sibling[node] = self.prev_sibling[node] = NO_NODE
+
+    def children(self, node):
+        child = self.first_child[node]
+        while child != NO_NODE:
+            yield child
+            child = self.next_sibling[child]
+
+    def walk(self, node):
+        """
+        Номера узлов поддерева (включая сам узел) в порядке обхода в глубину.
+        """
+        stack = [node]
+        first_child, next_sibling = self.first_child, self.next_sibling
+        while stack:
+            node = stack.pop()
+            yield node
+            child = first_child[node]
+            while child != NO_NODE:
+                stack.append(child)
+                child = next_sibling[child]
+
+    def walk_paths(self, node, path):
+        """
+        Пары (номер, путь) поддерева, где path — путь самого node: пути детей собираются
+        из пути родителя по ходу обхода, а не подъёмом к корню для каждого узла.
+        """
+        stack = [(node, path)]
+        first_child, next_sibling = self.first_child, self.next_sibling
+        while stack:
+            node, path = stack.pop()
+            yield node, path
+            child = first_child[node]
+            while child != NO_NODE:
+                stack.append((child, f"{path}/{self.name(child)}" if path else self.name(child)))
+                child = next_sibling[child]
+
+    def path(self, node):
+        parts = []
+        while self.parents[node] != NO_NODE:
+            parts.append(self.name(node))
+            node = self.parents[node]
+        return '/'.join(reversed(parts))
+
+
+class FsNode:
+    """
+    Узел дерева виртуальной файловой системы — лёгкое представление строки NodeTable.
+    Представления создаются по запросу; два представления одного узла равны.
+    Полный путь строится по цепочке родителей.
+    """
+    __slots__ = ("table", "id")
+
+    def __init__(self, table, node_id):
+        self.table = table
+        self.id = node_id
+
+    def __eq__(self, other):
+        return isinstance(other, FsNode) and self.id == other.id and self.table is other.table
+
+    def __hash__(self):
+        return self.id
+
+    def __repr__(self):
+        return f"FsNode({self.path()!r})"
+
+    @property
+    def name(self):
+        return self.table.name(self.id)
+
+    @property
+    def parent(self):
+        parent = self.table.parents[self.id]
+        return None if parent == NO_NODE else FsNode(self.table, parent)
+
+    @property
+    def is_dir(self):
+        return bool(self.table.flags[self.id] & IS_DIR)
+
+    @property
+    def children(self):
+        return Children(self.table, self.id) if self.table.flags[self.id] & IS_DIR else None
+
+    @property
+    def link_target(self):
+        """
+        Цель ссылки, как она записана в архиве, или None, если узел не ссылка.
+        """
+        link = self.table.links.get(self.id)
+        return None if link is None else link[1:]
+
+    @property
+    def is_symlink(self):
+        return self.table.links.get(self.id, "")[:1] == SYMBOLIC_LINK
+
+    @property
+    def is_hardlink(self):
+        return self.table.links.get(self.id, "")[:1] == HARD_LINK
+
+    @property
+    def mode(self):
+        return self.table.modes[self.id]
+
+    @mode.setter
+    def mode(self, value):
+        self.table.modes[self.id] = value
+
+    @property
+    def uid(self):
+        return self.table.owner_table[self.table.owners[self.id]][0]
+
+    @property
+    def gid(self):
+        return self.table.owner_table[self.table.owners[self.id]][1]
+
+    @property
+    def owner(self):
+        return self.table.owner_table[self.table.owners[self.id]][2]
+
+    @property
+    def group(self):
+        return self.table.owner_table[self.table.owners[self.id]][3]
+
+    @property
+    def layer(self):
+        return self.table.layers[self.id]
+
+    @layer.setter
+    def layer(self, value):
+        self.table.layers[self.id] = value
+
+    @property
+    def offset(self):
+        """
+        Смещение данных в архиве (только для обычных файлов), иначе None.
+        """
+        offset = self.table.offsets[self.id]
+        return None if offset < 0 else offset
+
+    @offset.setter
+    def offset(self, value):
+        self.table.offsets[self.id] = -1 if value is None else value
+
+    @property
+    def size(self):
+        return self.table.sizes[self.id]
+
+    @property
+    def mtime(self):
+        return self.table.mtimes[self.id]
+
+    @property
+    def header_offset(self):
+        """
+        Начало записи в архиве (заголовки + данные); None, если узла нет в архиве явно.
+        """
+        offset = self.table.header_offsets[self.id]
+        return None if offset < 0 else offset
+
+    @header_offset.setter
+    def header_offset(self, value):
+        self.table.header_offsets[self.id] = -1 if value is None else value
+
+    @property
+    def end_offset(self):
+        offset = self.table.end_offsets[self.id]
+        return None if offset < 0 else offset
+
+    @end_offset.setter
+    def end_offset(self, value):
+        self.table.end_offsets[self.id] = -1 if value is None else value
+
+    @property
+    def search_ok(self):
+        """
+        Кэш: можно ли пройти от корня до этой директории (x на всех директориях пути).
+        """
+        value = self.table.search_ok[self.id]
+        return None if value < 0 else bool(value)
+
+    @search_ok.setter
+    def search_ok(self, value):
+        self.table.search_ok[self.id] = -1 if value is None else int(value)
+
+    @property
+    def total_size(self):
+        return self.table.totals[self.id][0]
+
+    @property
+    def file_count(self):
+        return self.table.totals[self.id][1]
+
+    def totals(self):
+        """
+        (байты, число файлов) поддерева узла; файл считается сам по себе.
+        """
+        if self.table.flags[self.id] & IS_DIR:
+            return tuple(self.table.totals[self.id])
+        return self.table.sizes[self.id], 1
+
+    def path(self):
+        """
+        Возвращает путь узла относительно корня архива (без ведущего '/').
+        """
+        return self.table.path(self.id)
+
+    def walk(self):
+        """
+        Обходит поддерево узла (включая сам узел) в глубину.
+        """
+        table = self.table
+        return (FsNode(table, node) for node in table.walk(self.id))
+
+
+class Children(Mapping):
+    """
+    Дети директории как отображение имя -> FsNode (только для чтения).
+    """
+    __slots__ = ("table", "id")
+
+    def __init__(self, table, node_id):
+        self.table = table
+        self.id = node_id
+
+    def __getitem__(self, name):
+        node = self.table.child(self.id, name)
+        if node == NO_NODE:
+            raise KeyError(name)
+        return FsNode(self.table, node)
+
+    def get(self, name, default=None):
+        node = self.table.child(self.id, name)
+        return default if node == NO_NODE else FsNode(self.table, node)
+
+    def __contains__(self, name):
+        return self.table.child(self.id, name) != NO_NODE
+
+    def __iter__(self):
+        table = self.table
+        return (table.name(node) for node in table.children(self.id))
+
+    def __len__(self):
+        return sum(1 for _ in self.table.children(self.id))
+
+    def __bool__(self):
+        return self.table.first_child[self.id] != NO_NODE
+
+    def values(self):
+        table = self.table
+        return [FsNode(table, node) for node in table.children(self.id)]
+
+    def items(self):
+        table = self.table
+        return [(table.name(node), FsNode(table, node)) for node in table.children(self.id)]
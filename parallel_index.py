@@ -0,0 +1,146 @@
+import os
+import tarfile
+from concurrent.futures import ProcessPoolExecutor
+
+from index_cache import IndexColumns
+from node_table import HARD_LINK, SYMBOLIC_LINK
+
+MIN_PARALLEL_SIZE = 64 << 20  # Архивы меньше этого размера быстрее разобрать в одном процессе
+MIN_REGION_SIZE = 4 << 20
+REGIONS_PER_WORKER = 4  # Несколько областей на процесс выравнивают нагрузку
+SYNC_READ_SIZE = 1 << 16
+
+
+def member_row(member, end_offset):
+    """
+    Строка индекса для записи архива (TarInfo) — в том же формате, что и в <архив>.idx.
+    У ссылок последнее поле — флаг типа (HARD_LINK, SYMBOLIC_LINK) и цель как в архиве:
+    у жёсткой — от корня архива, у символической — от директории ссылки или абсолютная.
+    """
+    kind = HARD_LINK if member.islnk() else SYMBOLIC_LINK if member.issym() else None
+    linkname = kind + member.linkname if kind else ""
+    return (member.name, member.mode, member.uid, member.gid,
+            member.uname, member.gname, member.isdir(), member.offset, end_offset,
+            member.offset_data if member.isreg() else -1, member.size, int(member.mtime), linkname)
+
+
+class _HeaderReader:
+    """
+    Минимальная замена TarFile для TarInfo.fromtarfile(): позволяет разбирать
+    записи с произвольного смещения тем же кодом, что и tarfile
+    (GNU longname/longlink, pax, sparse).
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.encoding = tarfile.ENCODING
+        self.errors = "surrogateescape"
+        self.pax_headers = {}
+        self.offset = 0
+
+
+def _find_header(fileobj, start, end):
+    """
+    Ищет первый блок в [start, end), который разбирается как заголовок tar.
+    Найденный заголовок может оказаться данными файла — это проверяется при слиянии.
+    """
+    position = start
+    while position < end:
+        fileobj.seek(position)
+        data = fileobj.read(min(SYNC_READ_SIZE, end - position))
+        if not data:
+            return None
+        for index in range(0, len(data) - tarfile.BLOCKSIZE + 1, tarfile.BLOCKSIZE):
+            try:
+                tarfile.TarInfo.frombuf(data[index:index + tarfile.BLOCKSIZE],
+                                        tarfile.ENCODING, "surrogateescape")
+            except tarfile.HeaderError:
+                continue
+            return position + index
+        position += len(data)
+    return None
+
+
+def _walk_chain(reader, position, end):
+    """
+    Разбирает записи по цепочке заголовков, начиная с position, пока следующий
+    заголовок не окажется за end. Возвращает (строки IndexColumns, смещение следующего заголовка,
+    достигнут ли конец архива, встречены ли глобальные pax-поля).
+    """
+    rows = IndexColumns()
+    while position < end:
+        reader.fileobj.seek(position)
+        reader.offset = position
+        try:
+            member = tarfile.TarInfo.fromtarfile(reader)
+        except tarfile.HeaderError:
+            # Нулевой блок или мусор: tarfile на этом месте тоже заканчивает чтение
+            return rows, position, True, False
+        if any(key in tarfile.PAX_FIELDS or key.startswith("GNU.sparse.") for key in reader.pax_headers):
+            return rows, position, False, True  # Глобальный pax-заголовок влияет на все следующие записи
+        position = reader.offset
+        rows.append(member_row(member, position))
+    return rows, position, False, False
+
+
+def _scan_region(path, start, end):
+    """
+    Работа процесса: синхронизируется на первом заголовке области и разбирает
+    все записи, которые начинаются в [start, end).
+    """
+    with open(path, "rb") as fileobj:
+        first = _find_header(fileobj, start, end)
+        if first is None:
+            return start, end, None, IndexColumns(), None, False, False
+        rows, chain_end, at_end, unsupported = _walk_chain(_HeaderReader(fileobj), first, end)
+    return start, end, first, rows, chain_end, at_end, unsupported
+
+
+def _regions(size, workers):
+    region = max(MIN_REGION_SIZE, -(-size // (workers * REGIONS_PER_WORKER)))
+    region += -region % tarfile.BLOCKSIZE
+    return [(start, min(start + region, size)) for start in range(0, size, region)]
+
+
+def build_rows(path, workers=None):
+    """
+    Строит строки индекса несжатого tar несколькими процессами.
+    Архив делится на области; каждый процесс независимо находит в своей области
+    первый заголовок и идёт по цепочке заголовков. При слиянии цепочки проверяются
+    на непрерывность: область принимается, только если её цепочка проходит через
+    смещение, на котором закончилась предыдущая, иначе она разбирается заново с этого смещения.
+    Возвращает None, если параллельный разбор невозможен (глобальные pax-поля) —
+    тогда нужен обычный последовательный проход.
+    """
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(path)
+    regions = _regions(size, workers)
+    rows = IndexColumns()
+    position = 0  # Смещение, с которого должна продолжиться настоящая цепочка
+    with ProcessPoolExecutor(max_workers=workers) as pool, open(path, "rb") as fileobj:
+        results = pool.map(_scan_region, [path] * len(regions),
+                           [start for start, _ in regions], [end for _, end in regions])
+        for start, end, first, region_rows, chain_end, at_end, unsupported in results:
+            if position >= end:
+                continue  # Область целиком внутри данных уже разобранной записи
+            if unsupported:
+                return None
+            offsets = {offset: index for index, offset in enumerate(region_rows.header_offsets)}
+            index = offsets.get(position)
+            if index is None:
+                # Процесс синхронизировался на ложном заголовке (например, на tar внутри файла):
+                # дочитываем область сами от известной границы
+                region_rows, chain_end, at_end, unsupported = _walk_chain(
+                    _HeaderReader(fileobj), position, end)
+                if unsupported:
+                    return None
+                index = 0
+            rows.extend(region_rows, index)
+            position = chain_end
+            if at_end:
+                pool.shutdown(cancel_futures=True)
+                break
+    return rows
+
+
+def can_parallelize(path, workers):
+    return workers > 1 and os.path.getsize(path) >= MIN_PARALLEL_SIZE
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import sys
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+from emulator import ShellEmulator, add_common_arguments
+from fs_handler import VirtualFileSystem
+from instrumentation import Tracer
+
+# Сколько потокового вывода готовится за один захват блокировки (символов)
+STREAM_BATCH = 1 << 20
+
+# Команды, меняющие общее дерево: выполняются под блокировкой писателя
+MUTATING_COMMANDS = {"rm", "chmod", "commit", "sync", "compact", "touch", "mkdir", "cp", "mv", "echo", "refresh"}
+
+
+def next_batch(chunks, limit=STREAM_BATCH):
+    """
+    Берёт из потока куски общим размером не меньше limit: (куски, исчерпан ли поток).
+    """
+    batch = []
+    size = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            return batch, False
+    return batch, True
+
+
+def command_name(command):
+    """
+    Имя команды для выбора блокировки; для profile — имя профилируемой команды.
+    """
+    args = command.split()
+    while args[:1] == ["profile"]:
+        args = args[3:] if args[1:2] == ["-o"] else args[1:]
+    return args[0] if args else ""
+
+
+class ShellServer:
+    """
+    Сервер множества сессий оболочки над одним загруженным архивом.
+    У каждой сессии своя текущая директория, индекс и дескриптор архива общие.
+    """
+    def __init__(self, fs, max_workers=None):
+        self.fs = fs
+        self.sessions = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _execute(self, session, command, send):
+        """
+        Выполняет команду сессии под блокировкой читателя или писателя.
+        Потоковый вывод (cat, head, tail, find, grep) готовится порциями по STREAM_BATCH
+        под блокировкой, а передаётся в send уже без неё: медленный клиент не держит
+        ожидающего писателя, а за ним и все остальные сессии. Фоновых чтений между порциями
+        нет (grep дочитывает своё окно файлов до выдачи строк). Если за это время сменилось
+        поколение смещений дерева (commit, полная перестройка индекса при refresh),
+        поток обрывается с сообщением: узлы, по которым он читал, описывают прежний архив.
+        """
+        name = command_name(command)
+        lock = self.fs.lock.write if name in MUTATING_COMMANDS else self.fs.lock.read
+        with lock():
+            result = session.execute_command(command)
+            if result is None or isinstance(result, str):
+                return result
+            generation = self.fs.nodes.generation
+            batch, done = next_batch(result)
+        try:
+            last = ""
+            while True:
+                for chunk in batch:
+                    send(chunk)
+                    last = chunk
+                if done:
+                    break
+                with lock():
+                    stale = self.fs.nodes.generation != generation
+                    if not stale:
+                        batch, done = next_batch(result)
+                if stale:
+                    if last and not last.endswith("\n"):
+                        send("\n")
+                    return f"{name}: output interrupted, the archive was rewritten."
+            if last and not last.endswith("\n"):
+                send("\n")
+            return None
+        finally:
+            result.close()  # Поток, брошенный из-за отключения клиента, закрывает замер команды
+
+    async def handle_session(self, reader, writer):
+        session = ShellEmulator(None, fs=self.fs)
+        loop = asyncio.get_running_loop()
+        self.sessions += 1
+        try:
+            while session.running:
+                writer.write(session.prompt().encode("utf-8"))
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode("utf-8", errors="replace").rstrip("\r\n")
+                if not command:
+                    continue
+                # Команды работают с архивом синхронно, поэтому уходят в пул потоков
+                try:
+                    result = await loop.run_in_executor(
+                        self._executor, self._execute, session, command,
+                        lambda chunk: asyncio.run_coroutine_threadsafe(
+                            self._send(writer, chunk), loop).result())
+                except ConnectionError:
+                    raise
+                except (OSError, ValueError, tarfile.TarError) as error:
+                    # Ошибка одной команды (например, архив заменили на диске) не рвёт сессию
+                    result = f"{command_name(command)}: {error}"
+                if result:
+                    writer.write(result.encode("utf-8") + b"\n")
+        except ConnectionError:
+            pass
+        finally:
+            self.sessions -= 1
+            writer.close()
+
+    @staticmethod
+    async def _send(writer, chunk):
+        writer.write(chunk.encode("utf-8"))
+        await writer.drain()  # Обратное давление: поток не обгоняет медленного клиента
+
+    def _refresh(self):
+        with self.fs.lock.write():
+            return self.fs.refresh()
+
+    async def watch(self, interval):
+        """
+        Периодически подхватывает изменения архивов на диске под блокировкой писателя.
+        Ошибка чтения (например, архив заменяют прямо сейчас) не останавливает опрос.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self._executor, self._refresh)
+            except (OSError, tarfile.TarError) as error:
+                print(f"Archive refresh failed: {error}", file=sys.stderr)
+
+    async def serve(self, host="127.0.0.1", port=8023, unix_path=None, watch=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_session, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_session, host, port)
+        watcher = asyncio.create_task(self.watch(watch)) if watch is not None else None
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Shell emulator server")
+    add_common_arguments(parser)
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8023, help="TCP port to listen on")
+    parser.add_argument("--unix", metavar="PATH", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of threads executing commands")
+    parser.add_argument("--watch", type=float, default=None, metavar="SECONDS",
+                        help="Poll the archives on disk every SECONDS and pick up appended or rewritten entries")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fs = VirtualFileSystem(args.fs_archive, uid=args.uid, gid=args.gid,
+                           cache_size=args.cache_size << 20,
+                           tracer=Tracer(tracing=args.trace is not None),
+                           index_workers=args.index_workers)
+    server = ShellServer(fs, max_workers=args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix, args.watch))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.trace is not None:
+            fs.tracer.export(args.trace, args.trace_format)
+        fs.close()
+
+
+if __name__ == "__main__":
+    main()
+# python server.py test_fs.tar --port 8023
@@ -0,0 +1,35 @@
+import io
+import os
+import sys
+import tarfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_tar(path, members, mode="w"):
+    """
+    Пишет архив из списка (имя, содержимое); содержимое None — директория.
+    """
+    with tarfile.open(path, mode) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.mtime = 1_700_000_000
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.fixture
+def make_tar(tmp_path):
+    def make(members, name="fs.tar", mode="w"):
+        path = str(tmp_path / name)
+        write_tar(path, members, mode)
+        return path
+    return make
@@ -0,0 +1,38 @@
+import gzip
+import random
+import tarfile
+
+from archive_io import GzipArchive, GzipCheckpoints, GzipIndexedReader
+from conftest import write_tar
+
+
+def test_gzip_random_seeks_match_tarfile(tmp_path):
+    generator = random.Random(12)
+    members = [(f"f{index}.bin", generator.randbytes(generator.randrange(1, 300000))) for index in range(12)]
+    plain = str(tmp_path / "fs.tar")
+    write_tar(plain, members)
+    path = str(tmp_path / "fs.tar.gz")
+    with open(plain, "rb") as source, open(path, "wb") as target:
+        data = source.read()
+        middle = len(data) // 2  # Два члена gzip подряд: точки должны переходить и через границу
+        target.write(gzip.compress(data[:middle]) + gzip.compress(data[middle:]))
+
+    checkpoints = GzipCheckpoints(span=1 << 16)
+    with GzipIndexedReader(path, checkpoints) as stream, tarfile.open(fileobj=stream, mode="r:") as tar:
+        expected = {member.name: (member.offset_data, tar.extractfile(member).read()) for member in tar}
+    assert len(checkpoints.offsets) > 10
+
+    reader = GzipIndexedReader(path, checkpoints)
+    names = list(expected) * 3
+    generator.shuffle(names)
+    for name in names:
+        offset, content = expected[name]
+        start = generator.randrange(len(content))
+        reader.seek(offset + start)
+        assert reader.read(len(content) - start) == content[start:]
+    reader.close()
+
+    archive = GzipArchive(path)
+    for name, (offset, content) in expected.items():
+        assert archive.pread(offset, len(content)) == content
+    archive.close()
@@ -0,0 +1,52 @@
+import io
+import tarfile
+
+from fs_handler import VirtualFileSystem
+from index_cache import read_index
+from instrumentation import Tracer
+from node_table import ROOT, STORED_COLUMNS, NodeTable
+
+
+def make_links_tar(path):
+    with tarfile.open(path, "w") as tar:
+        for index in range(1500):  # Больше MIN_SLOTS: хеш-таблица успевает перестроиться
+            info = tarfile.TarInfo(f"d{index % 7}/файл-{index}.txt")
+            data = str(index).encode()
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        for name, kind, target in (("d0/sym", tarfile.SYMTYPE, "файл-0.txt"),
+                                   ("hard", tarfile.LNKTYPE, "d1/файл-1.txt")):
+            info = tarfile.TarInfo(name)
+            info.type, info.linkname = kind, target
+            tar.addfile(info)
+
+
+def tree_rows(fs):
+    table = fs.nodes
+    return sorted((path, table.modes[node], table.sizes[node], table.offsets[node], table.links.get(node))
+                  for node, path in table.walk_paths(ROOT, ""))
+
+
+def test_node_table_round_trip_through_index(tmp_path):
+    path = str(tmp_path / "fs.tar")
+    make_links_tar(path)
+    cold = VirtualFileSystem(path)
+
+    rows, tree = read_index(path)
+    assert len(rows) == 1502
+    table = NodeTable.load(tree)
+    for name in STORED_COLUMNS:
+        assert getattr(table, name) == getattr(cold.nodes, name)
+    # Хеш-таблица восстановлена как есть: поиск детей работает без перестройки
+    for node, path_in_tree in cold.nodes.walk_paths(ROOT, ""):
+        parent = ROOT
+        for part in path_in_tree.split("/") if path_in_tree else ():
+            parent = table.child(parent, part)
+        assert parent == node
+
+    tracer = Tracer()
+    warm = VirtualFileSystem(path, tracer=tracer)
+    assert tracer.summary()["counters"].get("headers_parsed", 0) == 0
+    assert tree_rows(warm) == tree_rows(cold)
+    assert warm.read_file("/hard") == b"1"
+    assert warm.read_file("/d0/sym") == b"0"
@@ -0,0 +1,35 @@
+import os
+import tarfile
+
+from journal import END_OF_ARCHIVE, Journal
+
+
+def member(name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info, [data]
+
+
+def test_recovery_drops_torn_tail(tmp_path):
+    path = str(tmp_path / "fs.tar.journal")
+    journal = Journal(path)
+    journal.append(*member("a.txt", b"a" * 700))
+    journal.append(*member("b.txt", b"b" * 100))
+    end = journal.end
+    journal.close()
+
+    # Сбой посреди записи: заголовок и часть данных без завершающих нулевых блоков
+    info, _ = member("c.txt", b"c" * 5000)
+    with open(path, "r+b") as torn:
+        torn.seek(end)
+        torn.write(info.tobuf(tarfile.DEFAULT_FORMAT, tarfile.ENCODING, "surrogateescape") + b"c" * 1500)
+
+    journal = Journal(path)
+    assert (journal.count, journal.end) == (2, end)
+    assert os.path.getsize(path) == end + len(END_OF_ARCHIVE)
+    journal.append(*member("d.txt", b"d" * 10))
+    journal.close()
+
+    with tarfile.open(path) as tar:
+        assert {name: tar.extractfile(name).read() for name in tar.getnames()} == {
+            "a.txt": b"a" * 700, "b.txt": b"b" * 100, "d.txt": b"d" * 10}
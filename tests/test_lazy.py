@@ -0,0 +1,29 @@
+import tarfile
+
+from fs_handler import VirtualFileSystem
+
+
+def test_directory_header_during_loading_resets_search_permission(make_tar, monkeypatch):
+    # Директория d сначала появляется неявно (0755 root), её заголовок с правами 0700 — позже
+    path = make_tar([("d/sub/f.txt", b"data")])
+    with tarfile.open(path, "a") as tar:
+        info = tarfile.TarInfo("d")
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o700
+        tar.addfile(info)
+
+    add_entry = VirtualFileSystem._add_entry
+    seen = []
+
+    def add_entry_after_command(fs, path, *args, **kwargs):
+        if path.strip("/") == "d":
+            # Команда, выполненная до того, как фоновая загрузка дошла до заголовка
+            seen.append(fs.is_searchable(fs._find("/d/sub")))
+        add_entry(fs, path, *args, **kwargs)
+
+    monkeypatch.setattr(VirtualFileSystem, "_add_entry", add_entry_after_command)
+    fs = VirtualFileSystem(path, lazy=True, use_index_cache=False, uid=1000, gid=1000)
+    fs.wait_loaded()
+
+    assert seen == [True]
+    assert not fs.is_searchable(fs.lookup("/d/sub"))
@@ -0,0 +1,32 @@
+import io
+import tarfile
+
+import parallel_index
+from conftest import write_tar
+from parallel_index import build_rows, member_row
+
+
+def sequential_rows(path):
+    with tarfile.open(path, "r:") as tar:
+        return [member_row(member, tar.offset) for member in tar]
+
+
+def test_parallel_rows_match_sequential_with_nested_tar(tmp_path, monkeypatch):
+    # Внутри члена лежит настоящий tar: его заголовки выглядят для процессов как начало цепочки
+    nested = io.BytesIO()
+    with tarfile.open(fileobj=nested, mode="w") as tar:
+        for index in range(40):
+            info = tarfile.TarInfo(f"fake/{index}.txt")
+            info.size = 3000
+            tar.addfile(info, io.BytesIO(b"f" * 3000))
+    path = str(tmp_path / "fs.tar")
+    members = [("a/one.txt", b"1" * 1000), ("a", None), ("inner.tar", nested.getvalue())]
+    members += [(f"b/{index}.txt", bytes([index]) * (index * 700)) for index in range(60)]
+    write_tar(path, members)
+    monkeypatch.setattr(parallel_index, "MIN_REGION_SIZE", 8 * tarfile.BLOCKSIZE)
+
+    rows = build_rows(path, workers=4)
+
+    assert rows is not None
+    assert list(rows) == sequential_rows(path)
+    assert not any(row[0].startswith("fake/") for row in rows)
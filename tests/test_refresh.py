@@ -0,0 +1,53 @@
+import errno
+
+import pytest
+
+from conftest import write_tar
+from fs_handler import REFRESH_RELOADED, VirtualFileSystem
+
+
+def test_open_file_goes_stale_after_full_reload(make_tar):
+    path = make_tar([("x.txt", b"A" * 200000), ("y.txt", b"Y" * 200000)])
+    fs = VirtualFileSystem(path, use_index_cache=False)
+    stream = fs.open("/y.txt")
+    assert stream.read(10) == b"Y" * 10
+
+    # Та же длина и тот же inode, но записи переставлены: смещения y.txt теперь у x.txt
+    write_tar(path, [("y.txt", b"Z" * 200000), ("x.txt", b"B" * 200000)])
+    assert fs.refresh() == REFRESH_RELOADED
+
+    with pytest.raises(OSError) as error:
+        stream.read()
+    assert error.value.errno == errno.ESTALE
+    assert fs.read_file("/y.txt") == b"Z" * 200000
+    assert fs.read_file("/x.txt") == b"B" * 200000
+
+
+def test_stream_goes_stale_after_full_reload(make_tar):
+    path = make_tar([("x.txt", b"A" * 200000), ("y.txt", b"Y" * 200000)])
+    fs = VirtualFileSystem(path, use_index_cache=False, cache_size=0)
+    chunks = fs.iter_file("/y.txt", chunk_size=1000)
+    assert next(chunks) == b"Y" * 1000
+
+    write_tar(path, [("y.txt", b"Z" * 200000), ("x.txt", b"B" * 200000)])
+    assert fs.refresh() == REFRESH_RELOADED
+
+    with pytest.raises(OSError) as error:
+        next(chunks)
+    assert error.value.errno == errno.ESTALE
+    assert fs.read_file("/y.txt") == b"Z" * 200000
+
+
+def test_open_file_survives_commit_unless_removed(make_tar):
+    path = make_tar([("a.txt", b"a" * 5000), ("b.txt", b"b" * 5000), ("c.txt", b"c" * 5000)])
+    fs = VirtualFileSystem(path, use_index_cache=False, cache_size=0)
+    kept, removed = fs.open("/c.txt"), fs.open("/b.txt")
+    fs.remove("/a.txt")
+    fs.remove("/b.txt")
+    fs.commit()
+
+    # c.txt сдвинулся в новом архиве, но остался в дереве: читается по новым смещениям
+    assert kept.read() == b"c" * 5000
+    with pytest.raises(OSError) as error:
+        removed.read()
+    assert error.value.errno == errno.ESTALE